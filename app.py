@@ -1,10 +1,15 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 import json
-from database import get_db_connection
+from database import db_connection, create_tables, save_contact_names, suppress_phones, OPT_OUT_REPLY
+from phone_numbers import normalize_phone
+from ingest import IngestJournal, IngestDrainer
+from notifications import NotificationHub, get_notifications_token, is_authorized
 import logging
-from whatsapp_sender import WhatsAppSender
+from whatsapp_sender import get_sender
 import os
-from datetime import datetime
+import queue
+import threading
+import time
 
 app = Flask(__name__)
 
@@ -19,43 +24,218 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Caminho para o arquivo de flag
-FLAG_FILE = "new_messages_flag.txt"
+# Configuração do envio assíncrono de respostas automáticas
+AUTO_REPLY_WORKERS = 4
+AUTO_REPLY_QUEUE_SIZE = 1000
+AUTO_REPLY_MAX_RETRIES = 3
+AUTO_REPLY_RETRY_DELAY = 2  # segundos, dobra a cada nova tentativa
 
-def create_update_flag_file():
-    """Cria ou atualiza o arquivo de flag para sinalizar novas mensagens"""
-    try:
-        with open(FLAG_FILE, "w") as f:
-            f.write(str(datetime.now()))
-        logger.info(f"Arquivo de flag atualizado: {FLAG_FILE}")
-    except Exception as e:
-        logger.error(f"Erro ao criar arquivo de flag: {e}")
+# Canal de avisos de novas mensagens para a interface (endpoint /events)
+notification_hub = NotificationHub()
 
 def handle_button_response(message_text, sender_number):
-    try:
-        whatsapp_sender = WhatsAppSender()
+    """Envia a resposta automática para um botão. Erros são propagados para permitir nova tentativa."""
+    whatsapp_sender = get_sender()
+   
+    if message_text == "Tenho Interesse":
+        response = (    "Olá! Que bom falar com você! 😊\n\n"
+                        "O Kelvin entrará em contato em breve para dar seguimento ao seu atendimento.\n\n"
+                        "Se preferir, pode falar com nosso suporte pelo WhatsApp clicando no link:\n\n"
+                        "https://wa.me/6136865169.\n\n"
+                        "Ficamos felizes em ajudar! Tenha um ótimo dia! 💰✨"
+                   )
+        whatsapp_sender.send_text_message(to=sender_number, message=response)
        
-        if message_text == "Tenho Interesse":
-            response = (    "Olá! Que bom falar com você! 😊\n\n"
-                            "O Kelvin entrará em contato em breve para dar seguimento ao seu atendimento.\n\n"
-                            "Se preferir, pode falar com nosso suporte pelo WhatsApp clicando no link:\n\n"
-                            "https://wa.me/6136865169.\n\n"
-                            "Ficamos felizes em ajudar! Tenha um ótimo dia! 💰✨"
-                       )
-            whatsapp_sender.send_text_message(to=sender_number, message=response)
-           
-        elif message_text == "Não":
-            response = ("Tudo bem, obrigado pelo seu retorno, se precisar de um empréstimo futuramente, pode contar comigo.\n"
-                       "Basta me chamar no numero 6136865169")
-            whatsapp_sender.send_text_message(to=sender_number, message=response)
+    elif message_text == "Não":
+        response = ("Tudo bem, obrigado pelo seu retorno, se precisar de um empréstimo futuramente, pode contar comigo.\n"
+                   "Basta me chamar no numero 6136865169")
+        whatsapp_sender.send_text_message(to=sender_number, message=response)
+
+class AutoReplyDispatcher:
+    """
+    Envia respostas automáticas em threads de fundo, fora do caminho da requisição do webhook.
+    
+    A fila é limitada: quando cheia, a resposta é descartada e contabilizada nas métricas
+    em vez de segurar o worker do Flask.
+    """
+    def __init__(self, workers=AUTO_REPLY_WORKERS, maxsize=AUTO_REPLY_QUEUE_SIZE,
+                 max_retries=AUTO_REPLY_MAX_RETRIES, retry_delay=AUTO_REPLY_RETRY_DELAY):
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.metrics = {'enqueued': 0, 'sent': 0, 'retried': 0, 'failed': 0, 'dropped': 0}
+        self.lock = threading.Lock()
+        self.started = False
+
+    def start(self):
+        """Inicia as threads de envio (apenas uma vez por processo)"""
+        with self.lock:
+            if self.started:
+                return
+            for i in range(self.workers):
+                threading.Thread(target=self._worker, name=f"auto-reply-{i}", daemon=True).start()
+            self.started = True
+
+    def _count(self, metric):
+        with self.lock:
+            self.metrics[metric] += 1
+
+    def submit(self, message_text, sender_number):
+        """Enfileira uma resposta automática. Retorna False se a fila estiver cheia."""
+        self.start()
+        try:
+            self.queue.put_nowait((message_text, sender_number))
+        except queue.Full:
+            self._count('dropped')
+            logger.warning(f"Fila de respostas automáticas cheia, resposta para {sender_number} descartada")
+            return False
+        self._count('enqueued')
+        return True
+
+    def _worker(self):
+        while True:
+            message_text, sender_number = self.queue.get()
+            try:
+                for attempt in range(self.max_retries + 1):
+                    try:
+                        handle_button_response(message_text, sender_number)
+                        self._count('sent')
+                        break
+                    except Exception as e:
+                        if attempt >= self.max_retries:
+                            self._count('failed')
+                            logger.error(f"Erro ao enviar resposta automática para {sender_number}: {e}")
+                        else:
+                            self._count('retried')
+                            logger.warning(f"Falha ao enviar resposta automática para {sender_number} "
+                                           f"(tentativa {attempt + 1}): {e}")
+                            time.sleep(self.retry_delay * (2 ** attempt))
+            finally:
+                self.queue.task_done()
+
+    def get_metrics(self):
+        """Retorna uma cópia das métricas com o tamanho atual da fila"""
+        with self.lock:
+            metrics = dict(self.metrics)
+        metrics['queue_size'] = self.queue.qsize()
+        return metrics
+
+auto_reply_dispatcher = AutoReplyDispatcher()
+
+def extract_messages(data):
+    """
+    Extrai as mensagens de um payload do webhook.
+    
+    Returns:
+        tuple: (linhas para a tabela messages, respostas de botão como (whatsapp_id, texto, remetente),
+            nomes de perfil como (telefone, nome))
+    """
+    rows = []
+    button_replies = []
+    contact_names = []
+   
+    for entry in data.get('entry', []):
+        logger.info(f"Processando entry: {entry}")
+        for change in entry.get('changes', []):
+            value = change.get('value', {})
+            messages = value.get('messages', [])
+            
+            for contact in value.get('contacts', []):
+                name = contact.get('profile', {}).get('name')
+                if contact.get('wa_id') and name:
+                    contact_names.append((contact['wa_id'], name))
            
-    except Exception as e:
-        logger.error(f"Erro ao enviar resposta automática: {e}")
+            for message in messages:
+                logger.info(f"Tipo de mensagem recebida: {message.keys()}")
+                whatsapp_id = message.get('id')
+                sender = message.get('from')
+                recipient = value.get('metadata', {}).get('display_phone_number', '')
+                text = None
+                message_type = None
+               
+                if 'text' in message:
+                    text = message['text'].get('body', '')
+                    message_type = 'text'
+                    logger.info(f"Mensagem de texto recebida: {text}")
+                elif 'button' in message:
+                    text = message['button'].get('text', '')
+                    message_type = 'button'
+                    logger.info(f"Resposta do botão recebida: {text}")
+                   
+                    if text in ["Tenho Interesse", OPT_OUT_REPLY]:
+                        button_replies.append((whatsapp_id, text, sender))
+               
+                if text and message_type:
+                    # Nova mensagem com visualized=0
+                    rows.append((whatsapp_id, sender, recipient, text, message_type, 'received', 0, 0))
+   
+    return rows, button_replies, contact_names
+
+def save_payloads(payloads):
+    """
+    Grava um lote de payloads do journal no banco principal em uma única transação.
+    
+    Mensagens reenviadas pela Meta (whatsapp_id já existente) são ignoradas em vez
+    de falhar o lote, e suas respostas automáticas não são enviadas de novo.
+    Exceções são propagadas para que o drainer tente novamente.
+    """
+    rows = []
+    button_replies = []
+    contact_names = {}
+    for data in payloads:
+        payload_rows, payload_replies, payload_names = extract_messages(data)
+        rows.extend(payload_rows)
+        button_replies.extend(payload_replies)
+        contact_names.update(payload_names)
+   
+    new_ids = []
+    inserted = set()
+    if rows:
+        with db_connection() as conn:
+            last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+            conn.executemany('''
+                INSERT OR IGNORE INTO messages
+                (whatsapp_id, sender, recipient, message, message_type, status, answered, visualized)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            # Nomes gravados na mesma transação: a interface busca o resumo assim que é avisada
+            save_contact_names(conn, list(contact_names.items()))
+            # Quem respondeu "Não" sai das próximas campanhas
+            opted_out = {normalize_phone(sender) for _, text, sender in button_replies if text == OPT_OUT_REPLY}
+            suppress_phones(conn, opted_out - {None})
+            new_rows = conn.execute("SELECT id, whatsapp_id FROM messages WHERE id > ? ORDER BY id",
+                                    (last_id,)).fetchall()
+            new_ids = [row[0] for row in new_rows]
+            inserted = {row[1] for row in new_rows}
+        logger.info(f"{len(new_ids)} de {len(rows)} mensagens salvas com sucesso")
+   
+    # Enfileirar as respostas automáticas só depois da gravação e só para as mensagens
+    # realmente inseridas agora: reentregas da Meta e lotes regravados não repetem a resposta
+    for whatsapp_id, text, sender in button_replies:
+        if whatsapp_id in inserted:
+            auto_reply_dispatcher.submit(text, sender)
+   
+    # Avisar a interface sobre as mensagens realmente gravadas
+    if new_ids:
+        notification_hub.publish(new_ids)
+        logger.info(f"Processadas {len(new_ids)} mensagens. Interface notificada.")
+
+ingest_journal = IngestJournal()
+ingest_drainer = IngestDrainer(ingest_journal, save_payloads)
+
+# Cabeçalhos que não vão para o webhook.log (token do canal /events e das métricas)
+REDACTED_HEADERS = {'authorization'}
+
+def loggable_headers():
+    """Cabeçalhos da requisição atual com os segredos mascarados"""
+    return {name: '***' if name.lower() in REDACTED_HEADERS else value
+            for name, value in request.headers.items()}
 
 @app.before_request
 def log_request_info():
     logger.info('=== Nova Requisição ===')
-    logger.info(f'Headers: {dict(request.headers)}')
+    logger.info(f'Headers: {loggable_headers()}')
     logger.info(f'Body: {request.get_data()}')
 
 @app.route('/webhook', methods=['GET', 'POST'])
@@ -84,63 +264,19 @@ def webhook():
         logger.info("=== NOVA MENSAGEM RECEBIDA NO WEBHOOK ===")
         try:
             data = request.get_json()
-            logger.info(f"Headers recebidos: {dict(request.headers)}")
+            logger.info(f"Headers recebidos: {loggable_headers()}")
             logger.info(f"Payload completo: {json.dumps(data, indent=2)}")
            
             if not data:
                 logger.error("Payload vazio")
                 return jsonify({"error": "No data received"}), 400
                
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            mensagens_processadas = 0
-           
-            for entry in data.get('entry', []):
-                logger.info(f"Processando entry: {entry}")
-                for change in entry.get('changes', []):
-                    value = change.get('value', {})
-                    messages = value.get('messages', [])
-                   
-                    for message in messages:
-                        logger.info(f"Tipo de mensagem recebida: {message.keys()}")
-                        whatsapp_id = message.get('id')
-                        sender = message.get('from')
-                        recipient = value.get('metadata', {}).get('display_phone_number', '')
-                        text = None
-                        message_type = None
-                       
-                        if 'text' in message:
-                            text = message['text'].get('body', '')
-                            message_type = 'text'
-                            logger.info(f"Mensagem de texto recebida: {text}")
-                        elif 'button' in message:
-                            text = message['button'].get('text', '')
-                            message_type = 'button'
-                            logger.info(f"Resposta do botão recebida: {text}")
-                           
-                            # Processa resposta automática para botões
-                            if text in ["Tenho Interesse", "Não"]:
-                                handle_button_response(text, sender)
-                       
-                        if text and message_type:
-                            # Salvar a nova mensagem com visualized=0
-                            cursor.execute('''
-                                INSERT INTO messages
-                                (whatsapp_id, sender, recipient, message, message_type, status, answered, visualized)
-                                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                            ''', (whatsapp_id, sender, recipient, text, message_type, 'received', 0, 0))
-                            
-                            conn.commit()
-                            mensagens_processadas += 1
-                            logger.info("Mensagem salva com sucesso")
-            
-            conn.close()
-            
-            # Se mensagens foram processadas, criar/atualizar o arquivo de flag
-            if mensagens_processadas > 0:
-                create_update_flag_file()
-                logger.info(f"Processadas {mensagens_processadas} mensagens. Flag de notificação criada.")
+            # Gravar o payload bruto no journal local e responder imediatamente;
+            # a gravação no banco principal é feita pelo drainer em segundo plano
+            ingest_journal.append(data)
+            ingest_drainer.start()
+            ingest_drainer.notify()
+            logger.info("Payload gravado no journal de ingestão")
            
             return jsonify({"status": "success"}), 200
            
@@ -148,5 +284,39 @@ def webhook():
             logger.error(f"Erro ao processar mensagem: {str(e)}", exc_info=True)
             return jsonify({"error": str(e)}), 500
 
+@app.route('/events', methods=['GET'])
+def events():
+    # Canal interno da interface desktop. Atrás do proxy/túnel que recebe a Meta toda
+    # requisição chega de 127.0.0.1, então o controle de acesso é o token compartilhado
+    if not is_authorized(request.headers.get('Authorization')):
+        return "Forbidden", 403
+    return Response(stream_with_context(notification_hub.stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# As métricas passam pelo mesmo túnel público que o webhook: exigem o token do /events
+@app.route('/metrics/auto-reply', methods=['GET'])
+def auto_reply_metrics():
+    if not is_authorized(request.headers.get('Authorization')):
+        return "Forbidden", 403
+    return jsonify(auto_reply_dispatcher.get_metrics()), 200
+
+@app.route('/metrics/ingest', methods=['GET'])
+def ingest_metrics():
+    if not is_authorized(request.headers.get('Authorization')):
+        return "Forbidden", 403
+    parked_count, parked = ingest_journal.parked()
+    return jsonify({
+        "pending_payloads": ingest_journal.pending_count(),
+        "parked_payloads": parked_count,
+        "parked": parked
+    }), 200
+
 if __name__ == '__main__':
+    # Com debug=True o reloader executa este bloco no processo vigia e no processo
+    # filho que atende as requisições (WERKZEUG_RUN_MAIN); o drainer só roda no filho.
+    # app.debug ainda é False aqui, por isso não serve para essa verificação
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        get_notifications_token(create=True)
+        create_tables()
+        ingest_drainer.start()
     app.run(host='0.0.0.0', port=8080, debug=True)
@@ -0,0 +1,120 @@
+import logging
+import threading
+import time
+
+from campaign_reader import file_key
+from database import (db_connection, find_running_campaign, start_campaign, fetch_campaign_progress,
+                      save_campaign_results, finish_campaign)
+
+logger = logging.getLogger(__name__)
+
+# Resultados acumulados antes de cada gravação no banco (uma transação por lote)
+LEDGER_BATCH_SIZE = 200
+LEDGER_FLUSH_INTERVAL = 2   # segundos; grava mesmo sem completar o lote
+
+# Status gravados por destinatário a partir do resultado do BulkSendEngine
+LEDGER_STATUSES = {'success': 'sent', 'error': 'error', 'skipped': 'skipped'}
+
+
+def campaign_signature(csv_path):
+    """Identifica a versão do CSV de uma campanha: caminho, data de modificação e tamanho"""
+    return '|'.join(str(part) for part in file_key(csv_path))
+
+
+class CampaignLedger:
+    """
+    Registro persistente de uma campanha em massa, destinatário por destinatário.
+
+    Cada linha do CSV processada vira uma linha em campaign_recipients com status
+    ('sent', 'error' ou 'skipped'), id da mensagem e erro. Os resultados são
+    gravados em lotes de LEDGER_BATCH_SIZE (ou a cada LEDGER_FLUSH_INTERVAL
+    segundos); se o processo cair, no máximo o último lote ainda não gravado
+    é reenviado ao retomar.
+
+    Ao retomar, as linhas já enviadas ou ignoradas são puladas e as com erro
+    são tentadas de novo.
+
+    Args:
+        campaign_id (int): Id da campanha na tabela campaigns
+        done_rows (set, opcional): Linhas já concluídas em uma execução anterior
+        sent_phones (set, opcional): Telefones que já receberam a mensagem
+        batch_size (int, opcional): Resultados acumulados por gravação
+    """
+    def __init__(self, campaign_id, done_rows=None, sent_phones=None, batch_size=LEDGER_BATCH_SIZE):
+        self.campaign_id = campaign_id
+        self.done_rows = done_rows or set()
+        self.sent_phones = sent_phones or set()
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.pending = []
+        self.last_flush = time.monotonic()
+
+    @classmethod
+    def find_resumable(cls, csv_path, template_name):
+        """
+        Procura uma campanha interrompida com o mesmo arquivo e template.
+
+        Returns:
+            tuple: (id da campanha, mensagens já enviadas), ou None
+        """
+        return find_running_campaign(campaign_signature(csv_path), template_name)
+
+    @classmethod
+    def open(cls, csv_path, template_name, resume=True):
+        """
+        Abre o registro da campanha: retoma a interrompida do mesmo arquivo e
+        template (resume=True) ou começa uma nova do zero.
+        """
+        signature = campaign_signature(csv_path)
+        if resume:
+            found = find_running_campaign(signature, template_name)
+            if found:
+                campaign_id = found[0]
+                done_rows, sent_phones = fetch_campaign_progress(campaign_id)
+                return cls(campaign_id, done_rows, sent_phones)
+        return cls(start_campaign(csv_path, signature, template_name))
+
+    @property
+    def resumed(self):
+        return bool(self.done_rows)
+
+    @property
+    def resume_from(self):
+        """Primeira linha ainda não concluída; as anteriores são descartadas na leitura do CSV"""
+        row = 0
+        while row in self.done_rows:
+            row += 1
+        return row
+
+    def record(self, row_index, phone, outcome, message_id=None, error=None):
+        """Acumula o resultado de um destinatário; grava o lote quando ele enche ou o intervalo passa"""
+        with self.lock:
+            self.pending.append((int(row_index), phone, LEDGER_STATUSES[outcome], message_id, error))
+            due = (len(self.pending) >= self.batch_size
+                   or time.monotonic() - self.last_flush >= LEDGER_FLUSH_INTERVAL)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Grava os resultados pendentes em uma única transação"""
+        with self.lock:
+            batch, self.pending = self.pending, []
+            self.last_flush = time.monotonic()
+        if not batch:
+            return
+        try:
+            with db_connection() as conn:
+                save_campaign_results(conn, self.campaign_id, batch)
+        except Exception as e:
+            # Devolver o lote para a próxima tentativa em vez de perder o registro
+            logger.error(f"Erro ao gravar o registro da campanha {self.campaign_id}: {e}")
+            with self.lock:
+                self.pending[:0] = batch
+
+    def finish(self):
+        """Grava o que falta e marca a campanha como concluída (não será mais retomada)"""
+        self.flush()
+        if self.pending:
+            logger.error(f"Campanha {self.campaign_id} mantida como interrompida: registro incompleto")
+            return
+        finish_campaign(self.campaign_id)
@@ -0,0 +1,235 @@
+import codecs
+import csv
+import os
+import threading
+
+import pandas as pd
+
+# Quantidade de linhas lidas do CSV por vez durante uma campanha
+CSV_CHUNK_SIZE = 5000
+# Bloco usado na contagem de linhas por varredura de bytes
+COUNT_BLOCK_SIZE = 1024 * 1024
+
+# Detecção de formato: bytes lidos do início do arquivo e separadores aceitos
+SNIFF_SIZE = 64 * 1024
+SNIFF_MAX_LINES = 50
+CSV_SEPARATORS = ';,\t|'
+FORMAT_CACHE_SIZE = 32
+# Usada quando um byte inválido em UTF-8 aparece depois da amostra (aceita qualquer byte)
+FALLBACK_ENCODING = 'latin1'
+
+_format_cache = {}
+_format_cache_lock = threading.Lock()
+# Contagens de linhas já feitas (mesma chave do cache de formato)
+_count_cache = {}
+
+
+def file_key(path):
+    """Identifica uma versão do arquivo: caminho, data de modificação e tamanho"""
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+
+def _sniff_encoding(sample):
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        # final=False: um caractere cortado no fim da amostra não conta como erro
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'latin1'
+
+
+def _sniff_separator(text):
+    lines = [line for line in text.splitlines()[:SNIFF_MAX_LINES] if line.strip()]
+    if not lines:
+        return ';'
+    try:
+        return csv.Sniffer().sniff('\n'.join(lines), delimiters=CSV_SEPARATORS).delimiter
+    except csv.Error:
+        # Amostra ambígua: o separador mais frequente no cabeçalho, com ';' como padrão
+        header = lines[0]
+        return max(CSV_SEPARATORS, key=lambda sep: (header.count(sep), sep == ';'))
+
+
+def detect_csv_format(path):
+    """
+    Descobre separador e codificação do CSV a partir dos primeiros bytes do arquivo.
+
+    O arquivo é lido uma única vez (SNIFF_SIZE bytes) e o resultado fica em cache
+    por caminho, data de modificação e tamanho, de modo que a visualização e o
+    envio da mesma lista não repetem a detecção.
+
+    Returns:
+        tuple: (separador, codificação)
+    """
+    key = file_key(path)
+    with _format_cache_lock:
+        if key in _format_cache:
+            return _format_cache[key]
+
+    with open(path, 'rb') as f:
+        sample = f.read(SNIFF_SIZE)
+    encoding = _sniff_encoding(sample)
+    text = sample.decode(encoding, errors='ignore')
+    if len(sample) == SNIFF_SIZE:
+        text = text.rsplit('\n', 1)[0]   # descartar a última linha, possivelmente incompleta
+    result = (_sniff_separator(text), encoding)
+
+    _remember_format(key, result)
+    return result
+
+
+def _remember_format(key, result):
+    with _format_cache_lock:
+        if key not in _format_cache and len(_format_cache) >= FORMAT_CACHE_SIZE:
+            _format_cache.pop(next(iter(_format_cache)))
+        _format_cache[key] = result
+
+
+class CampaignReader:
+    """
+    Leitura em fluxo de uma lista de contatos em CSV.
+
+    O arquivo é lido em blocos de chunk_size linhas e cada linha vira um dict
+    coluna -> texto. Todas as colunas são lidas como texto (telefones não viram
+    float) e células vazias viram "". A memória usada não depende do tamanho
+    do arquivo, e o primeiro registro fica disponível assim que o primeiro
+    bloco é lido.
+
+    Se a codificação foi detectada como UTF-8 pela amostra e um byte inválido
+    aparece mais adiante, a leitura passa para FALLBACK_ENCODING em vez de
+    trocar os caracteres acentuados por "�".
+
+    Args:
+        path (str): Caminho do arquivo CSV
+        sep (str, opcional): Separador; detectado se não informado
+        encoding (str, opcional): Codificação; detectada se não informada
+        normalize_columns (bool, opcional): Remove espaços e converte os nomes das colunas para minúsculas
+        chunk_size (int, opcional): Linhas por bloco
+    """
+    def __init__(self, path, sep=None, encoding=None, normalize_columns=False, chunk_size=CSV_CHUNK_SIZE):
+        self.path = path
+        self.detected_encoding = encoding is None
+        if sep is None or encoding is None:
+            guessed_sep, guessed_encoding = detect_csv_format(path)
+            sep = sep or guessed_sep
+            encoding = encoding or guessed_encoding
+        self.sep = sep
+        self.encoding = encoding
+        self.normalize_columns = normalize_columns
+        self.chunk_size = chunk_size
+        self._columns = None
+
+    def _read(self, **kwargs):
+        return pd.read_csv(self.path, sep=self.sep, encoding=self.encoding,
+                           dtype=str, keep_default_na=False, **kwargs)
+
+    def _fall_back_encoding(self, error):
+        """
+        Troca a codificação detectada por FALLBACK_ENCODING depois de um erro de
+        decodificação. Retorna False se não há para onde voltar (codificação
+        informada pelo chamador ou já em FALLBACK_ENCODING).
+        """
+        if not self.detected_encoding or self.encoding == FALLBACK_ENCODING:
+            return False
+        print(f"Arquivo não está em {self.encoding} ({error}); relendo como {FALLBACK_ENCODING}")
+        self.encoding = FALLBACK_ENCODING
+        _remember_format(file_key(self.path), (self.sep, self.encoding))
+        return True
+
+    def _rename(self, df):
+        if self.normalize_columns:
+            df.columns = [str(col).strip().lower() for col in df.columns]
+        return df
+
+    @property
+    def columns(self):
+        """Nomes das colunas, lidos apenas do cabeçalho"""
+        if self._columns is None:
+            self._columns = list(self.head(0).columns)
+        return self._columns
+
+    def head(self, n=10):
+        """Retorna as n primeiras linhas como DataFrame, sem ler o resto do arquivo"""
+        try:
+            return self._rename(self._read(nrows=n))
+        except UnicodeDecodeError as e:
+            if not self._fall_back_encoding(e):
+                raise
+            return self._rename(self._read(nrows=n))
+
+    def frames(self, start_row=0):
+        """
+        Gera os blocos do arquivo como DataFrames (o índice continua de um bloco para o outro).
+
+        Args:
+            start_row (int, opcional): Primeira linha de dados a gerar. A contagem é a
+                das linhas interpretadas (o mesmo índice dos blocos), não das linhas
+                físicas do arquivo: linhas em branco e campos com quebra de linha não
+                a deslocam. Blocos inteiros antes dela são descartados sem cópia
+        """
+        next_row = start_row
+        while True:
+            try:
+                with self._read(chunksize=self.chunk_size) as reader:
+                    for chunk in reader:
+                        if next_row:
+                            if chunk.empty or chunk.index[-1] < next_row:
+                                continue
+                            if chunk.index[0] < next_row:
+                                chunk = chunk[chunk.index >= next_row]
+                        if not chunk.empty:
+                            next_row = chunk.index[-1] + 1
+                        yield self._rename(chunk)
+                return
+            except UnicodeDecodeError as e:
+                # Relê com a nova codificação a partir da primeira linha ainda não entregue
+                if not self._fall_back_encoding(e):
+                    raise
+
+    def chunks(self):
+        """Gera os blocos do arquivo como listas de registros (dicts)"""
+        for frame in self.frames():
+            yield frame.to_dict('records')
+
+    def records(self):
+        """Gera (índice, registro) para cada linha, começando em 0"""
+        index = 0
+        for chunk in self.chunks():
+            for record in chunk:
+                yield index, record
+                index += 1
+
+    def count_rows(self):
+        """
+        Conta as linhas de dados varrendo os bytes do arquivo, sem interpretá-lo.
+
+        Quebras de linha dentro de campos entre aspas também são contadas, então
+        o valor serve como total para o progresso, não como contagem exata. O
+        resultado fica em cache: o envio reaproveita a contagem da visualização.
+        """
+        key = file_key(self.path)
+        with _format_cache_lock:
+            if key in _count_cache:
+                return _count_cache[key]
+
+        lines = 0
+        last = b'\n'
+        with open(self.path, 'rb') as f:
+            while True:
+                block = f.read(COUNT_BLOCK_SIZE)
+                if not block:
+                    break
+                lines += block.count(b'\n')
+                last = block[-1:]
+        if last != b'\n':
+            lines += 1   # última linha sem quebra no final
+        rows = max(0, lines - 1)   # descontar o cabeçalho
+
+        with _format_cache_lock:
+            if len(_count_cache) >= FORMAT_CACHE_SIZE:
+                _count_cache.pop(next(iter(_count_cache)))
+            _count_cache[key] = rows
+        return rows
@@ -1,49 +1,774 @@
 import sqlite3
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
 
-def get_db_connection():
-    conn = sqlite3.connect(r'W:\.shortcut-targets-by-id\1-1D2HTD7zuv4Z2Dem_VT9aK7ymJ-nItv\3 SA\Consigo Cred\Banco de Dados\DB_Consigocred.db')
+DB_PATH = os.getenv('DB_PATH', r'W:\.shortcut-targets-by-id\1-1D2HTD7zuv4Z2Dem_VT9aK7ymJ-nItv\3 SA\Consigo Cred\Banco de Dados\DB_Consigocred.db')
+
+# Sistemas de arquivos de rede onde o SQLite não garante WAL nem mmap
+NETWORK_FILESYSTEMS = ('nfs', 'nfs4', 'cifs', 'smb', 'smbfs', 'smb3', 'fuse.sshfs', '9p')
+DRIVE_REMOTE = 4    # GetDriveTypeW no Windows
+LOCAL_MMAP_SIZE = 268435456     # 256 MB mapeados em memória para leituras
+
+def is_network_path(path):
+    """Indica se o arquivo está em um drive ou compartilhamento de rede"""
+    path = os.path.abspath(path)
+    if path.startswith('\\\\') or path.startswith('//'):
+        return True     # caminho UNC (\\servidor\pasta)
+    if os.name == 'nt':
+        import ctypes
+        drive = os.path.splitdrive(path)[0]
+        return bool(drive) and ctypes.windll.kernel32.GetDriveTypeW(drive + '\\') == DRIVE_REMOTE
+    try:
+        with open('/proc/mounts') as f:
+            mounts = [line.split()[1:3] for line in f]
+    except OSError:
+        return False
+    # Ponto de montagem mais longo que contém o caminho
+    fs_type = max(((mount, fs) for mount, fs in mounts
+                   if path == mount or path.startswith(mount.rstrip('/') + '/')),
+                  key=lambda item: len(item[0]), default=(None, ''))[1]
+    return fs_type in NETWORK_FILESYSTEMS
+
+# Ajustes aplicados a cada conexão aberta. O padrão é seguro para o banco no drive
+# de rede (journal DELETE, sem mmap). O WAL permite leituras da GUI em paralelo com
+# a escrita do webhook, mas só funciona com todos os processos na mesma máquina e
+# o banco em disco local: é opcional (DB_JOURNAL_MODE=WAL).
+DB_JOURNAL_MODE = os.getenv('DB_JOURNAL_MODE', 'DELETE').upper()
+DB_SETTINGS = {
+    'journal_mode': DB_JOURNAL_MODE,
+    'busy_timeout': 5000,       # ms esperando um lock antes de "database is locked"
+    # NORMAL é seguro com WAL e bem mais rápido que FULL; sem WAL, FULL
+    'synchronous': 'NORMAL' if DB_JOURNAL_MODE == 'WAL' else 'FULL',
+    'cache_size': -20000,       # valor negativo = KiB (~20 MB de cache de páginas)
+    # mmap só com o banco em disco local
+    'mmap_size': int(os.getenv('DB_MMAP_SIZE', 0 if is_network_path(DB_PATH) else LOCAL_MMAP_SIZE)),
+}
+
+def configure_db(**settings):
+    """
+    Altera os ajustes usados pelas próximas conexões.
+    
+    Exemplo: configure_db(busy_timeout=10000, journal_mode='DELETE')
+    """
+    unknown = set(settings) - set(DB_SETTINGS)
+    if unknown:
+        raise ValueError(f"Configurações desconhecidas: {', '.join(sorted(unknown))}")
+    DB_SETTINGS.update(settings)
+    # Conexões do pool foram abertas com os ajustes antigos
+    pool.invalidate()
+
+def get_db_settings():
+    """Retorna uma cópia dos ajustes atuais de conexão"""
+    return dict(DB_SETTINGS)
+
+def get_db_connection(path=None, check_same_thread=True):
+    conn = sqlite3.connect(path or DB_PATH, timeout=DB_SETTINGS['busy_timeout'] / 1000,
+                           check_same_thread=check_same_thread)
     conn.row_factory = sqlite3.Row  # Permite acessar colunas por nome
+    conn.execute(f"PRAGMA journal_mode={DB_SETTINGS['journal_mode']}")
+    conn.execute(f"PRAGMA busy_timeout={int(DB_SETTINGS['busy_timeout'])}")
+    conn.execute(f"PRAGMA synchronous={DB_SETTINGS['synchronous']}")
+    conn.execute(f"PRAGMA cache_size={int(DB_SETTINGS['cache_size'])}")
+    conn.execute(f"PRAGMA mmap_size={int(DB_SETTINGS['mmap_size'])}")
     return conn
 
-def create_tables():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Verificar se a tabela existe
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='messages'")
-    table_exists = cursor.fetchone()
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except sqlite3.Error:
+        pass
+
+class _ThreadConnection:
+    """Conexão de uma thread do pool; fechada quando a thread termina e seu threading.local é descartado"""
+    def __init__(self, conn, generation):
+        self.conn = conn
+        self.generation = generation
+        self.depth = 0
+        self.close = weakref.finalize(self, _close_quietly, conn)
+
+class ConnectionPool:
+    """
+    Mantém uma conexão aberta por thread e a reaproveita entre consultas.
     
-    if table_exists:
-        # Verificar se as colunas recipient e answered existem
-        cursor.execute("PRAGMA table_info(messages)")
-        columns = {col[1] for col in cursor.fetchall()}
-        
-        # Adicionar colunas faltantes se necessário
-        if 'recipient' not in columns:
-            cursor.execute("ALTER TABLE messages ADD COLUMN recipient TEXT")
+    Evita reabrir o arquivo no drive de rede (e reler o schema) a cada consulta.
+    A conexão pertence só à thread que a abriu e é fechada quando essa thread
+    termina, então threads de curta duração (envios em massa, workers) não
+    acumulam arquivos abertos.
+    Uso:
+        with pool.connection() as conn:
+            conn.execute(...)
+    A transação é confirmada ao sair do bloco mais externo, ou desfeita em caso de erro.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.generation = 0
+
+    def _get(self):
+        current = getattr(self.local, 'current', None)
+        # Dentro de uma transação a conexão é mantida mesmo após invalidate()
+        if current is not None and (current.depth or current.generation == self.generation):
+            return current
+        if current is not None:
+            current.close()
+        # check_same_thread=False apenas para permitir o fechamento pelo coletor de lixo
+        # quando a thread dona termina; a conexão continua sendo usada somente por ela
+        conn = get_db_connection(self.path, check_same_thread=False)
+        self.local.current = _ThreadConnection(conn, self.generation)
+        return self.local.current
+
+    @contextmanager
+    def connection(self):
+        current = self._get()
+        current.depth += 1
+        try:
+            yield current.conn
+        except BaseException:
+            if current.depth == 1:
+                current.conn.rollback()
+            raise
+        else:
+            if current.depth == 1:
+                current.conn.commit()
+        finally:
+            current.depth -= 1
+
+    def release(self):
+        """Fecha a conexão da thread atual (a próxima consulta abre outra)"""
+        current = getattr(self.local, 'current', None)
+        if current is not None and not current.depth:
+            current.close()
+            self.local.current = None
+
+    def invalidate(self):
+        """
+        Faz cada thread reabrir sua conexão na próxima consulta (ex.: após mudar os ajustes).
         
-        if 'answered' not in columns:
-            cursor.execute("ALTER TABLE messages ADD COLUMN answered INTEGER DEFAULT 0")
-    else:
-        # Criar tabela com todas as colunas necessárias
+        Nenhuma conexão é fechada daqui: cada thread fecha a sua própria, fora de
+        transação, em vez de perder uma conexão em uso por outra thread.
+        """
+        with self.lock:
+            self.generation += 1
+
+pool = ConnectionPool()
+
+def db_connection():
+    """Context manager com a conexão reaproveitada da thread atual"""
+    return pool.connection()
+
+def migration_001_messages_table(cursor):
+    """Cria a tabela messages ou adiciona as colunas que faltam em bancos antigos"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        whatsapp_id TEXT UNIQUE NOT NULL,
+        sender TEXT NOT NULL,
+        recipient TEXT,
+        message TEXT NOT NULL,
+        message_type TEXT DEFAULT 'text',
+        status TEXT DEFAULT 'received',
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        conversation_status TEXT DEFAULT 'pending',
+        answered INTEGER DEFAULT 0,
+        visualized INTEGER DEFAULT 0
+    )
+    ''')
+    
+    cursor.execute("PRAGMA table_info(messages)")
+    columns = {col[1] for col in cursor.fetchall()}
+    
+    # Adicionar colunas faltantes se necessário
+    if 'recipient' not in columns:
+        cursor.execute("ALTER TABLE messages ADD COLUMN recipient TEXT")
+    
+    if 'answered' not in columns:
+        cursor.execute("ALTER TABLE messages ADD COLUMN answered INTEGER DEFAULT 0")
+    
+    if 'visualized' not in columns:
+        cursor.execute("ALTER TABLE messages ADD COLUMN visualized INTEGER DEFAULT 0")
+
+def migration_002_messages_indexes(cursor):
+    """Índices para as consultas da interface (por contato, não lidas e por data)"""
+    # Histórico de uma conversa: mensagens recebidas filtram por sender,
+    # enviadas por recipient, ambas ordenadas por timestamp
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_sender_timestamp ON messages (sender, timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_recipient_timestamp ON messages (recipient, timestamp)")
+    # Índice parcial: só as mensagens ainda não visualizadas
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_unread ON messages (sender) WHERE visualized = 0")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp)")
+
+def rebuild_conversations(cursor):
+    """Recalcula toda a tabela conversations a partir de messages"""
+    cursor.execute("DELETE FROM conversations")
+    cursor.execute('''
+        INSERT INTO conversations (contact, last_timestamp, last_message, unread_count, answered)
+        SELECT
+            c.contact,
+            c.last_timestamp,
+            COALESCE((
+                SELECT m2.message FROM messages m2
+                WHERE m2.sender = c.contact
+                ORDER BY m2.timestamp DESC, m2.id DESC LIMIT 1
+            ), ''),
+            c.unread_count,
+            c.answered
+        FROM (
+            SELECT
+                CASE WHEN sender = 'Você' THEN recipient ELSE sender END AS contact,
+                MAX(timestamp) AS last_timestamp,
+                SUM(CASE WHEN sender != 'Você' AND COALESCE(visualized, 0) = 0 THEN 1 ELSE 0 END) AS unread_count,
+                MIN(CASE WHEN sender != 'Você' AND COALESCE(answered, 0) = 0 THEN 0 ELSE 1 END) AS answered
+            FROM messages
+            GROUP BY contact
+            HAVING contact IS NOT NULL AND contact != 'Você'
+        ) c
+    ''')
+
+def migration_003_conversations_summary(cursor):
+    """Tabela resumo de conversas, mantida por triggers a cada escrita em messages"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS conversations (
+        contact TEXT PRIMARY KEY,
+        last_timestamp DATETIME,
+        last_message TEXT DEFAULT '',
+        unread_count INTEGER DEFAULT 0,
+        answered INTEGER DEFAULT 1
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversations_order ON conversations (unread_count DESC, last_timestamp DESC)")
+    
+    # Nova mensagem: atualiza última mensagem/data, contador de não lidas e estado de resposta
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_messages_insert_conversations
+    AFTER INSERT ON messages
+    WHEN NEW.sender != 'Você' OR (NEW.recipient IS NOT NULL AND NEW.recipient != 'Você')
+    BEGIN
+        INSERT INTO conversations (contact, last_timestamp, last_message, unread_count, answered)
+        VALUES (
+            CASE WHEN NEW.sender = 'Você' THEN NEW.recipient ELSE NEW.sender END,
+            NEW.timestamp,
+            CASE WHEN NEW.sender != 'Você' THEN NEW.message ELSE '' END,
+            CASE WHEN NEW.sender != 'Você' AND COALESCE(NEW.visualized, 0) = 0 THEN 1 ELSE 0 END,
+            CASE WHEN NEW.sender = 'Você' THEN 1 ELSE COALESCE(NEW.answered, 0) END
+        )
+        ON CONFLICT(contact) DO UPDATE SET
+            last_timestamp = MAX(COALESCE(last_timestamp, ''), excluded.last_timestamp),
+            last_message = CASE WHEN NEW.sender != 'Você' THEN excluded.last_message ELSE last_message END,
+            unread_count = unread_count + excluded.unread_count,
+            answered = CASE WHEN NEW.sender = 'Você' THEN answered ELSE excluded.answered END;
+    END
+    ''')
+    
+    # Mensagem marcada como lida (ou não lida)
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_messages_visualized_conversations
+    AFTER UPDATE OF visualized ON messages
+    WHEN NEW.sender != 'Você' AND COALESCE(OLD.visualized, 0) != COALESCE(NEW.visualized, 0)
+    BEGIN
+        UPDATE conversations
+        SET unread_count = MAX(0, unread_count + CASE WHEN COALESCE(NEW.visualized, 0) = 0 THEN 1 ELSE -1 END)
+        WHERE contact = NEW.sender;
+    END
+    ''')
+    
+    # Mensagem respondida: a conversa fica respondida quando não restar recebida sem resposta
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_messages_answered_conversations
+    AFTER UPDATE OF answered ON messages
+    WHEN NEW.sender != 'Você'
+    BEGIN
+        UPDATE conversations
+        SET answered = NOT EXISTS (
+            SELECT 1 FROM messages
+            WHERE sender = NEW.sender AND COALESCE(answered, 0) = 0
+        )
+        WHERE contact = NEW.sender;
+    END
+    ''')
+    
+    # Exclusões são raras: recalcula apenas o contato afetado
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_messages_delete_conversations
+    AFTER DELETE ON messages
+    BEGIN
+        DELETE FROM conversations
+        WHERE contact = CASE WHEN OLD.sender = 'Você' THEN OLD.recipient ELSE OLD.sender END;
+        INSERT INTO conversations (contact, last_timestamp, last_message, unread_count, answered)
+        SELECT
+            CASE WHEN OLD.sender = 'Você' THEN OLD.recipient ELSE OLD.sender END,
+            MAX(timestamp),
+            COALESCE((
+                SELECT m2.message FROM messages m2
+                WHERE m2.sender = CASE WHEN OLD.sender = 'Você' THEN OLD.recipient ELSE OLD.sender END
+                ORDER BY m2.timestamp DESC, m2.id DESC LIMIT 1
+            ), ''),
+            SUM(CASE WHEN sender != 'Você' AND COALESCE(visualized, 0) = 0 THEN 1 ELSE 0 END),
+            MIN(CASE WHEN sender != 'Você' AND COALESCE(answered, 0) = 0 THEN 0 ELSE 1 END)
+        FROM messages
+        WHERE sender = CASE WHEN OLD.sender = 'Você' THEN OLD.recipient ELSE OLD.sender END
+           OR (sender = 'Você' AND recipient = CASE WHEN OLD.sender = 'Você' THEN OLD.recipient ELSE OLD.sender END)
+        HAVING COUNT(*) > 0;
+    END
+    ''')
+    
+    rebuild_conversations(cursor)
+
+def migration_004_contacts_table(cursor):
+    """Nome de perfil dos contatos, informado pelo webhook junto com as mensagens"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS contacts (
+        phone TEXT PRIMARY KEY,
+        name TEXT,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+def migration_005_messages_fts(cursor):
+    """Índice de texto completo (FTS5) sobre o conteúdo das mensagens, mantido por triggers"""
+    create_messages_fts(cursor)
+
+def create_messages_fts(cursor):
+    """
+    Cria messages_fts com seus triggers e indexa o histórico.
+    
+    Returns:
+        bool: False se o SQLite não tem FTS5 (ensure_messages_fts tenta de novo
+            nas próximas inicializações)
+    """
+    # Tabela de conteúdo externo: o texto continua só em messages, o FTS guarda o índice
+    try:
         cursor.execute('''
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            whatsapp_id TEXT UNIQUE NOT NULL,
-            sender TEXT NOT NULL,
-            recipient TEXT,
-            message TEXT NOT NULL,
-            message_type TEXT DEFAULT 'text',
-            status TEXT DEFAULT 'received',
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            conversation_status TEXT DEFAULT 'pending',
-            answered INTEGER DEFAULT 0
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            message,
+            content='messages',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
         )
         ''')
+    except sqlite3.OperationalError as e:
+        # SQLite sem FTS5: search_messages usa LIKE como alternativa
+        print(f"FTS5 indisponível, busca por conteúdo será lenta: {e}")
+        return False
+    
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_messages_insert_fts
+    AFTER INSERT ON messages
+    BEGIN
+        INSERT INTO messages_fts (rowid, message) VALUES (NEW.id, NEW.message);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_messages_delete_fts
+    AFTER DELETE ON messages
+    BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, message) VALUES ('delete', OLD.id, OLD.message);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_messages_update_fts
+    AFTER UPDATE OF message ON messages
+    BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, message) VALUES ('delete', OLD.id, OLD.message);
+        INSERT INTO messages_fts (rowid, message) VALUES (NEW.id, NEW.message);
+    END
+    ''')
+    
+    # Indexar o histórico já existente
+    cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+    return True
+
+def has_messages_fts(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone() is not None
+
+def ensure_messages_fts(conn):
+    """
+    Cria o índice FTS que a migração 5 pulou por falta de FTS5 no SQLite.
     
-    conn.commit()
-    conn.close()
-    print("Banco de dados e tabela atualizados com sucesso!")
+    Roda a cada inicialização depois das migrações; não faz nada se o índice já
+    existe, e o cria (indexando o histórico) assim que o SQLite passar a ter FTS5.
+    """
+    if has_messages_fts(conn):
+        return
+    begin_immediate(conn)
+    try:
+        if not has_messages_fts(conn) and create_messages_fts(conn.cursor()):
+            print("Índice de busca por conteúdo (messages_fts) criado")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+# Resposta de botão que coloca o contato na lista de exclusão das campanhas
+OPT_OUT_REPLY = 'Não'
+
+def migration_006_suppressions(cursor):
+    """Lista de exclusão das campanhas (quem respondeu "Não"), indexada pelo telefone normalizado"""
+    from phone_numbers import normalize_phone
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS suppressions (
+        phone TEXT PRIMARY KEY,
+        reason TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    ) WITHOUT ROWID
+    ''')
+    
+    # Incluir quem já respondeu "Não" antes desta versão
+    senders = cursor.execute('''
+        SELECT DISTINCT sender FROM messages
+        WHERE message_type = 'button' AND message = ?
+    ''', (OPT_OUT_REPLY,)).fetchall()
+    phones = {normalize_phone(row[0]) for row in senders} - {None}
+    cursor.executemany(
+        "INSERT OR IGNORE INTO suppressions (phone, reason) VALUES (?, 'opt_out')",
+        [(phone,) for phone in phones]
+    )
+
+def migration_007_campaign_ledger(cursor):
+    """Campanhas em massa e o registro de envio de cada destinatário, para retomar envios interrompidos"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS campaigns (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        csv_path TEXT NOT NULL,
+        csv_signature TEXT NOT NULL,
+        template_name TEXT NOT NULL,
+        status TEXT DEFAULT 'running',
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        finished_at DATETIME
+    )
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_campaigns_signature
+    ON campaigns (csv_signature, template_name, status)
+    ''')
+    
+    # Uma linha por linha do CSV já processada; row_index é a posição da linha no arquivo
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS campaign_recipients (
+        campaign_id INTEGER NOT NULL REFERENCES campaigns (id),
+        row_index INTEGER NOT NULL,
+        phone TEXT,
+        status TEXT NOT NULL,
+        message_id TEXT,
+        error TEXT,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (campaign_id, row_index)
+    ) WITHOUT ROWID
+    ''')
+
+# Migrações em ordem; a versão aplicada fica gravada em PRAGMA user_version
+MIGRATIONS = [
+    (1, migration_001_messages_table),
+    (2, migration_002_messages_indexes),
+    (3, migration_003_conversations_summary),
+    (4, migration_004_contacts_table),
+    (5, migration_005_messages_fts),
+    (6, migration_006_suppressions),
+    (7, migration_007_campaign_ledger),
+]
+
+# Tempo máximo esperando outro processo (GUI ou webhook) terminar uma migração
+MIGRATION_LOCK_TIMEOUT = 300    # segundos
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def begin_immediate(conn, timeout=MIGRATION_LOCK_TIMEOUT):
+    """Abre uma transação já com o lock de escrita, esperando até timeout segundos por ele"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            return
+        except sqlite3.OperationalError as e:
+            # Cada tentativa já espera busy_timeout; migrações longas podem passar disso
+            if 'locked' not in str(e) or time.monotonic() >= deadline:
+                raise
+
+def migrate(conn):
+    """
+    Aplica as migrações pendentes, cada uma em sua própria transação.
+    
+    A GUI e o webhook migram ao iniciar: cada migração roda em uma transação
+    IMMEDIATE e a versão é relida depois de obtido o lock, então só um dos
+    processos aplica cada migração e o outro apenas a pula.
+    
+    Returns:
+        int: Versão do schema após a execução
+    """
+    if conn.in_transaction:
+        conn.commit()
+    current_version = get_schema_version(conn)
+    for version, migration in MIGRATIONS:
+        if version <= current_version:
+            continue
+        cursor = conn.cursor()
+        try:
+            begin_immediate(conn)
+            current_version = get_schema_version(conn)
+            if version <= current_version:
+                # Aplicada por outro processo enquanto esperávamos o lock
+                conn.rollback()
+                continue
+            migration(cursor)
+            cursor.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Migração {version} aplicada: {migration.__name__}")
+        current_version = version
+    if current_version >= 5:
+        ensure_messages_fts(conn)
+    return current_version
+
+def create_tables():
+    with db_connection() as conn:
+        version = migrate(conn)
+    print(f"Banco de dados atualizado com sucesso! Versão do schema: {version}")
+
+def get_last_message_id():
+    """Retorna o maior id da tabela messages (marca d'água para sincronização incremental)"""
+    with db_connection() as conn:
+        return conn.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+
+def fetch_messages_since(last_id, limit=500):
+    """
+    Retorna as mensagens gravadas depois de last_id, em ordem de id.
+    
+    Como id é crescente, o chamador guarda o id da última linha recebida e o
+    repassa na próxima chamada para obter só as novas linhas.
+    """
+    with db_connection() as conn:
+        return conn.execute('''
+            SELECT id, whatsapp_id, sender, recipient, message, message_type,
+                status, timestamp, answered, visualized
+            FROM messages
+            WHERE id > ?
+            ORDER BY id
+            LIMIT ?
+        ''', (last_id, limit)).fetchall()
+
+# Número da conta comercial que recebe as mensagens do webhook
+BUSINESS_PHONE_NUMBER = '556199571754'
+
+def fetch_conversation_page(contact, before=None, limit=50):
+    """
+    Retorna uma página do histórico de um contato, em ordem cronológica.
+    
+    Paginação por chave (timestamp, id): before é o (timestamp, id) da mensagem
+    mais antiga já exibida; None traz as mensagens mais recentes. O custo não
+    depende do tamanho do histórico, ao contrário de OFFSET.
+    """
+    keyset = ''
+    keyset_params = []
+    if before is not None:
+        keyset = 'AND (timestamp, id) < (?, ?)'
+        keyset_params = [before[0], before[1]]
+    # Uma consulta por direção (recebidas/enviadas), cada uma lendo só `limit` linhas
+    # do seu índice; o "+" impede o SQLite de escolher o índice da outra coluna
+    params = ([contact, BUSINESS_PHONE_NUMBER] + keyset_params + [limit]
+              + [contact] + keyset_params + [limit, limit])
+    with db_connection() as conn:
+        rows = conn.execute(f'''
+            SELECT * FROM (
+                SELECT id, sender, recipient, message, timestamp, status FROM messages
+                WHERE sender = ? AND +recipient = ? {keyset}
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ?
+            )
+            UNION ALL
+            SELECT * FROM (
+                SELECT id, sender, recipient, message, timestamp, status FROM messages
+                WHERE +sender = 'Você' AND recipient = ? {keyset}
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ?
+            )
+            ORDER BY timestamp DESC, id DESC
+            LIMIT ?
+        ''', params).fetchall()
+    rows.reverse()
+    return rows
+
+def fetch_all_conversations():
+    """Retorna o resumo de todas as conversas, com o nome do contato quando conhecido"""
+    with db_connection() as conn:
+        return conn.execute('''
+            SELECT c.contact, c.unread_count, c.last_timestamp, c.last_message, c.answered, k.name
+            FROM conversations c
+            LEFT JOIN contacts k ON k.phone = c.contact
+            ORDER BY c.unread_count DESC, c.last_timestamp DESC
+        ''').fetchall()
+
+def fetch_conversations(contacts):
+    """Retorna o resumo (tabela conversations) apenas dos contatos informados"""
+    contacts = list(contacts)
+    if not contacts:
+        return []
+    placeholders = ', '.join('?' for _ in contacts)
+    with db_connection() as conn:
+        return conn.execute(f'''
+            SELECT c.contact, c.unread_count, c.last_timestamp, c.last_message, c.answered, k.name
+            FROM conversations c
+            LEFT JOIN contacts k ON k.phone = c.contact
+            WHERE c.contact IN ({placeholders})
+        ''', contacts).fetchall()
+
+# Quantidade máxima de resultados da busca por conteúdo
+MESSAGE_SEARCH_LIMIT = 200
+
+def build_fts_query(text):
+    """
+    Converte o texto digitado em uma consulta FTS5.
+    
+    Cada palavra vira um termo entre aspas (sem operadores vindos do usuário) e
+    todas precisam aparecer; a última é buscada como prefixo, para funcionar
+    enquanto ainda está sendo digitada.
+    """
+    terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+    if not terms:
+        return None
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+def search_messages(text, contact=None, since=None, limit=MESSAGE_SEARCH_LIMIT):
+    """
+    Busca mensagens pelo conteúdo, das mais relevantes para as menos relevantes.
+    
+    Args:
+        text (str): Palavras buscadas (ex.: "tenho interesse")
+        contact (str, opcional): Restringe a uma conversa
+        since (str, opcional): Data/hora mínima, no formato de messages.timestamp
+        limit (int, opcional): Quantidade máxima de resultados
+        
+    Returns:
+        list: Linhas com id, sender, recipient, message, timestamp, status e snippet
+    """
+    query = build_fts_query(text)
+    if query is None:
+        return []
+    
+    filters = ''
+    params = [query]
+    if contact:
+        filters += ' AND (m.sender = ? OR m.recipient = ?)'
+        params += [contact, contact]
+    if since:
+        filters += ' AND m.timestamp >= ?'
+        params.append(since)
+    
+    with db_connection() as conn:
+        try:
+            return conn.execute(f'''
+                SELECT m.id, m.sender, m.recipient, m.message, m.timestamp, m.status,
+                    snippet(messages_fts, 0, '[', ']', '…', 12) AS snippet
+                FROM messages_fts
+                JOIN messages m ON m.id = messages_fts.rowid
+                WHERE messages_fts MATCH ? {filters}
+                ORDER BY rank
+                LIMIT ?
+            ''', params + [limit]).fetchall()
+        except sqlite3.OperationalError as e:
+            if 'messages_fts' not in str(e):
+                raise
+        # Sem índice FTS5 (ver migration_005): varredura com LIKE, mais recentes primeiro
+        params[0] = f"%{text.strip()}%"
+        return conn.execute(f'''
+            SELECT m.id, m.sender, m.recipient, m.message, m.timestamp, m.status,
+                m.message AS snippet
+            FROM messages m
+            WHERE m.message LIKE ? {filters}
+            ORDER BY m.timestamp DESC
+            LIMIT ?
+        ''', params + [limit]).fetchall()
+
+def suppress_phones(conn, phones, reason='opt_out'):
+    """Inclui telefones (já normalizados) na lista de exclusão das campanhas"""
+    conn.executemany(
+        "INSERT OR IGNORE INTO suppressions (phone, reason) VALUES (?, ?)",
+        [(phone, reason) for phone in phones]
+    )
+
+def load_suppressed_phones():
+    """Retorna o conjunto de telefones que não devem receber campanhas"""
+    with db_connection() as conn:
+        return {row[0] for row in conn.execute("SELECT phone FROM suppressions")}
+
+def find_running_campaign(csv_signature, template_name):
+    """
+    Procura uma campanha interrompida com o mesmo arquivo (mesma versão) e template.
+    
+    Returns:
+        tuple: (id, quantidade de mensagens já enviadas), ou None se não houver
+    """
+    with db_connection() as conn:
+        row = conn.execute('''
+            SELECT id FROM campaigns
+            WHERE csv_signature = ? AND template_name = ? AND status = 'running'
+            ORDER BY id DESC LIMIT 1
+        ''', (csv_signature, template_name)).fetchone()
+        if row is None:
+            return None
+        sent = conn.execute('''
+            SELECT COUNT(*) FROM campaign_recipients WHERE campaign_id = ? AND status = 'sent'
+        ''', (row[0],)).fetchone()[0]
+    return row[0], sent
+
+def start_campaign(csv_path, csv_signature, template_name):
+    """Registra uma nova campanha (abandonando as interrompidas do mesmo arquivo e template) e retorna seu id"""
+    with db_connection() as conn:
+        conn.execute('''
+            UPDATE campaigns SET status = 'abandoned'
+            WHERE csv_signature = ? AND template_name = ? AND status = 'running'
+        ''', (csv_signature, template_name))
+        cursor = conn.execute('''
+            INSERT INTO campaigns (csv_path, csv_signature, template_name) VALUES (?, ?, ?)
+        ''', (csv_path, csv_signature, template_name))
+        return cursor.lastrowid
+
+def fetch_campaign_progress(campaign_id):
+    """
+    Retorna o que já foi feito em uma campanha.
+    
+    Returns:
+        tuple: (linhas concluídas - enviadas ou ignoradas, telefones já enviados);
+            linhas com erro ficam de fora e são tentadas de novo ao retomar
+    """
+    with db_connection() as conn:
+        rows = conn.execute('''
+            SELECT row_index, phone, status FROM campaign_recipients
+            WHERE campaign_id = ? AND status IN ('sent', 'skipped')
+        ''', (campaign_id,)).fetchall()
+    done_rows = {row_index for row_index, _, _ in rows}
+    sent_phones = {phone for _, phone, status in rows if status == 'sent'}
+    return done_rows, sent_phones
+
+def save_campaign_results(conn, campaign_id, results):
+    """Grava o resultado de um lote de destinatários; results é uma lista de (linha, telefone, status, message_id, erro)"""
+    conn.executemany('''
+        INSERT INTO campaign_recipients (campaign_id, row_index, phone, status, message_id, error)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(campaign_id, row_index) DO UPDATE SET
+            phone = excluded.phone, status = excluded.status, message_id = excluded.message_id,
+            error = excluded.error, updated_at = CURRENT_TIMESTAMP
+    ''', [(campaign_id,) + tuple(result) for result in results])
+
+def finish_campaign(campaign_id):
+    with db_connection() as conn:
+        conn.execute('''
+            UPDATE campaigns SET status = 'finished', finished_at = CURRENT_TIMESTAMP WHERE id = ?
+        ''', (campaign_id,))
+
+def save_contact_names(conn, names):
+    """Grava (ou atualiza) o nome de perfil dos contatos; names é uma lista de (telefone, nome)"""
+    conn.executemany('''
+        INSERT INTO contacts (phone, name) VALUES (?, ?)
+        ON CONFLICT(phone) DO UPDATE SET name = excluded.name, updated_at = CURRENT_TIMESTAMP
+        WHERE name IS NOT excluded.name
+    ''', names)
 
 if __name__ == '__main__':
     create_tables()
@@ -0,0 +1,222 @@
+import sqlite3
+import threading
+import logging
+import json
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Spool local (fora do drive de rede) onde os payloads do webhook são gravados
+INGEST_SPOOL_PATH = os.getenv('INGEST_SPOOL_PATH', 'ingest_spool.db')
+INGEST_BATCH_SIZE = 100
+INGEST_MAX_ATTEMPTS = 20   # falhas do próprio payload; banco indisponível não conta
+INGEST_IDLE_INTERVAL = 5    # segundos entre verificações quando não há aviso de novos payloads
+INGEST_RETRY_DELAY = 2      # segundos, dobra a cada falha consecutiva
+INGEST_MAX_RETRY_DELAY = 60
+INGEST_LEASE_SECONDS = 300  # tempo que um lote fica reservado para o drainer que o buscou
+
+
+class IngestJournal:
+    """
+    Journal append-only dos payloads recebidos pelo webhook.
+
+    Usa um arquivo SQLite local com WAL e synchronous=FULL: o payload está em disco
+    antes do webhook responder 200, mesmo que o banco principal esteja indisponível.
+    """
+    def __init__(self, path=INGEST_SPOOL_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS payloads (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                received_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                payload TEXT NOT NULL,
+                attempts INTEGER DEFAULT 0,
+                last_error TEXT,
+                leased_until REAL
+            )
+        ''')
+        columns = {col[1] for col in self.conn.execute("PRAGMA table_info(payloads)")}
+        if 'leased_until' not in columns:
+            self.conn.execute("ALTER TABLE payloads ADD COLUMN leased_until REAL")
+        self.conn.commit()
+
+    def append(self, payload):
+        """Grava um payload bruto no journal e retorna seu id"""
+        with self.lock, self.conn:
+            cursor = self.conn.execute("INSERT INTO payloads (payload) VALUES (?)", (json.dumps(payload),))
+            return cursor.lastrowid
+
+    def fetch_batch(self, limit=INGEST_BATCH_SIZE, max_attempts=INGEST_MAX_ATTEMPTS, lease=INGEST_LEASE_SECONDS):
+        """
+        Reserva os payloads pendentes mais antigos e os retorna como lista de (id, payload).
+
+        A reserva vale por lease segundos e é feita em uma transação IMMEDIATE: outro
+        drainer usando o mesmo spool (outro processo) não recebe os mesmos payloads.
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.conn.execute('''
+                    SELECT id, payload FROM payloads
+                    WHERE attempts < ? AND (leased_until IS NULL OR leased_until < ?)
+                    ORDER BY id
+                    LIMIT ?
+                ''', (max_attempts, now, limit)).fetchall()
+                self.conn.executemany("UPDATE payloads SET leased_until = ? WHERE id = ?",
+                                      [(now + lease, row_id) for row_id, _ in rows])
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+        return [(row_id, json.loads(payload)) for row_id, payload in rows]
+
+    def delete(self, ids):
+        """Remove do journal os payloads já gravados no banco principal"""
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM payloads WHERE id = ?", [(row_id,) for row_id in ids])
+
+    def mark_failed(self, ids, error):
+        """Registra uma tentativa de gravação que falhou e libera a reserva"""
+        with self.lock, self.conn:
+            self.conn.executemany('''
+                UPDATE payloads SET attempts = attempts + 1, last_error = ?, leased_until = NULL WHERE id = ?
+            ''', [(str(error), row_id) for row_id in ids])
+
+    def release(self, ids, error):
+        """Libera a reserva sem contar tentativa (falha do banco, não do payload)"""
+        with self.lock, self.conn:
+            self.conn.executemany('''
+                UPDATE payloads SET last_error = ?, leased_until = NULL WHERE id = ?
+            ''', [(str(error), row_id) for row_id in ids])
+
+    def pending_count(self, max_attempts=INGEST_MAX_ATTEMPTS):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM payloads WHERE attempts < ?",
+                                     (max_attempts,)).fetchone()[0]
+
+    def parked(self, max_attempts=INGEST_MAX_ATTEMPTS, limit=INGEST_BATCH_SIZE):
+        """
+        Payloads que esgotaram as tentativas e não são mais processados.
+
+        Returns:
+            tuple: (quantidade total, lista dos mais antigos como dicts id/received_at/attempts/last_error)
+        """
+        with self.lock:
+            total = self.conn.execute("SELECT COUNT(*) FROM payloads WHERE attempts >= ?",
+                                      (max_attempts,)).fetchone()[0]
+            rows = self.conn.execute('''
+                SELECT id, received_at, attempts, last_error FROM payloads
+                WHERE attempts >= ?
+                ORDER BY id
+                LIMIT ?
+            ''', (max_attempts, limit)).fetchall()
+        return total, [dict(zip(('id', 'received_at', 'attempts', 'last_error'), row)) for row in rows]
+
+
+class IngestDrainer:
+    """
+    Thread de fundo que esvazia o journal em lotes.
+
+    Se o lote falha com sqlite3.OperationalError (banco indisponível ou travado),
+    ele é tentado de novo sem contar tentativa. Qualquer outro erro faz o lote ser
+    regravado payload a payload: só os que falharem contam tentativa e, depois de
+    INGEST_MAX_ATTEMPTS, ficam parados no journal (ver IngestJournal.parked).
+
+    Args:
+        journal (IngestJournal): Journal de onde os payloads são lidos
+        handler (callable): Recebe a lista de payloads do lote e os grava no banco
+            em uma única transação; deve lançar exceção se a gravação falhar
+        batch_size (int, opcional): Quantidade máxima de payloads por lote
+    """
+    def __init__(self, journal, handler, batch_size=INGEST_BATCH_SIZE):
+        self.journal = journal
+        self.handler = handler
+        self.batch_size = batch_size
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        self.started = False
+
+    def start(self):
+        """Inicia a thread de drenagem (apenas uma vez por processo)"""
+        with self.lock:
+            if self.started:
+                return
+            threading.Thread(target=self._run, name="ingest-drainer", daemon=True).start()
+            self.started = True
+
+    def notify(self):
+        """Acorda o drainer para processar payloads recém-gravados"""
+        self.wakeup.set()
+
+    def _run(self):
+        delay = INGEST_RETRY_DELAY
+        while True:
+            try:
+                result = self._drain_batch()
+            except Exception as e:
+                # Erro no próprio journal (ex.: spool travado): a thread não pode morrer,
+                # senão o webhook continua respondendo 200 sem gravar nada no banco
+                logger.error(f"Erro no journal de ingestão, nova tentativa em {delay}s: {e}")
+                result = False
+
+            if result is None:
+                self.wakeup.wait(INGEST_IDLE_INTERVAL)
+                self.wakeup.clear()
+            elif result:
+                delay = INGEST_RETRY_DELAY
+            else:
+                time.sleep(delay)
+                delay = min(delay * 2, INGEST_MAX_RETRY_DELAY)
+
+    def _drain_batch(self):
+        """
+        Grava um lote do journal no banco.
+
+        Returns:
+            None se o journal está vazio, False se o banco está indisponível (esperar
+            antes de tentar de novo) e True caso contrário
+        """
+        batch = self.journal.fetch_batch(self.batch_size)
+        if not batch:
+            return None
+
+        ids = [row_id for row_id, _ in batch]
+        try:
+            self.handler([payload for _, payload in batch])
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Banco indisponível ao gravar {len(ids)} payloads do journal: {e}")
+            self.journal.release(ids, e)
+            return False
+        except Exception as e:
+            logger.error(f"Erro ao gravar {len(ids)} payloads do journal, gravando um a um: {e}")
+            return self._save_one_by_one(batch)
+        self.journal.delete(ids)
+        return True
+
+    def _save_one_by_one(self, batch):
+        """
+        Grava individualmente os payloads de um lote que falhou.
+
+        Payloads com erro só contam tentativa (sem espera, para não atrasar os
+        demais remetentes); retorna False apenas se o banco ficou indisponível.
+        """
+        for position, (row_id, payload) in enumerate(batch):
+            try:
+                self.handler([payload])
+            except sqlite3.OperationalError as e:
+                # O banco caiu no meio: devolver o resto do lote sem contar tentativa
+                logger.warning(f"Banco indisponível ao gravar o payload {row_id} do journal: {e}")
+                self.journal.release([rest_id for rest_id, _ in batch[position:]], e)
+                return False
+            except Exception as e:
+                logger.error(f"Erro ao gravar o payload {row_id} do journal no banco: {e}")
+                self.journal.mark_failed([row_id], e)
+                continue
+            self.journal.delete([row_id])
+        return True
@@ -1,18 +1,21 @@
 import tkinter as tk
 from tkinter import ttk, scrolledtext, filedialog
 from datetime import datetime
-import sqlite3
-from database import get_db_connection
+from database import db_connection, create_tables, get_last_message_id, fetch_messages_since, fetch_conversations, fetch_all_conversations, fetch_conversation_page, search_messages, load_suppressed_phones
 import threading
 import queue
+from concurrent.futures import ThreadPoolExecutor
 import emoji
 import shutil
 import os
 import time
 import json
-import pandas as pd
 from tkinter import messagebox
-from whatsapp_sender import process_csv_and_send_messages, WhatsAppSender, process_csv_with_dynamic_template
+from whatsapp_sender import process_csv_and_send_messages, get_sender, reload_sender, process_csv_with_dynamic_template
+from notifications import NotificationListener
+from campaign_reader import CampaignReader
+from campaign_ledger import CampaignLedger
+from phone_numbers import normalize_phone
 from PIL import Image, ImageTk
 import sv_ttk  # Precisa instalar: pip install sv-ttk
 import webbrowser
@@ -30,6 +33,11 @@ COLORS = {
     "unread_bg": "#E8F5E9"      # Verde muito claro para destacar não lidas
 }
 
+# Quantidade de mensagens carregadas por página no histórico da conversa
+CHAT_PAGE_SIZE = 50
+# Espera após a última tecla antes de filtrar a lista de conversas (ms)
+SEARCH_DEBOUNCE_MS = 150
+
 class EmojiSelector(tk.Toplevel):
     def __init__(self, parent, callback):
         super().__init__(parent)
@@ -117,6 +125,240 @@ class EmojiSelector(tk.Toplevel):
         self.callback(emoji_char)
         self.destroy()
 
+class BackgroundTasks:
+    """
+    Executa consultas ao banco e chamadas à API fora da thread do Tk.
+    
+    O resultado volta para a thread principal via root.after. Tarefas enviadas com
+    a mesma chave se substituem: só a mais recente entrega o resultado, e as
+    obsoletas que ainda não começaram nem chegam a rodar.
+    """
+    def __init__(self, root, max_workers=4):
+        self.root = root
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gui-worker")
+        self.lock = threading.Lock()
+        self.generations = {}
+
+    def _is_current(self, key, generation):
+        return key is None or self.generations.get(key) == generation
+
+    def submit(self, func, on_success=None, on_error=None, key=None):
+        """
+        Agenda func em segundo plano.
+        
+        Args:
+            func (callable): Função sem argumentos executada no worker
+            on_success (callable, opcional): Recebe o retorno de func, na thread do Tk
+            on_error (callable, opcional): Recebe a exceção, na thread do Tk
+            key (str, opcional): Tarefas com a mesma chave cancelam as anteriores
+        """
+        generation = None
+        if key is not None:
+            with self.lock:
+                generation = self.generations[key] = self.generations.get(key, 0) + 1
+        
+        def run():
+            if not self._is_current(key, generation):
+                return
+            try:
+                result, error = func(), None
+            except Exception as e:
+                import traceback
+                traceback.print_exc()
+                result, error = None, e
+            
+            def deliver():
+                if not self._is_current(key, generation):
+                    return
+                if error is not None:
+                    if on_error:
+                        on_error(error)
+                    else:
+                        print(f"Erro em tarefa de segundo plano: {error}")
+                elif on_success:
+                    on_success(result)
+            
+            try:
+                self.root.after(0, deliver)
+            except (RuntimeError, tk.TclError):
+                pass  # Janela já foi fechada
+        
+        return self.executor.submit(run)
+
+    def cancel(self, key):
+        """Descarta o resultado da tarefa pendente com esta chave"""
+        with self.lock:
+            if key in self.generations:
+                self.generations[key] += 1
+
+class ContactSearchIndex:
+    """
+    Índice em memória para a busca de conversas por número ou nome do contato.
+    
+    É alimentado pelos mesmos resumos que montam a lista, de modo que digitar na
+    busca nunca consulta o banco. Quando o termo só cresce (o caso comum ao
+    digitar), a busca filtra o resultado anterior em vez de varrer tudo.
+    """
+    def __init__(self):
+        self.keys = {}            # contato -> texto pesquisável (minúsculo)
+        self.last_term = None
+        self.last_matches = None
+
+    @staticmethod
+    def _key(contact, name):
+        key = contact.lower()
+        if name:
+            key += '\n' + name.lower()
+        return key
+
+    @staticmethod
+    def _normalize(term):
+        """Termos que parecem telefone ("+55 (61) 9957-") são comparados só pelos dígitos"""
+        term = term.strip().lower()
+        digits = ''.join(ch for ch in term if ch.isdigit())
+        if digits and all(ch.isdigit() or ch in ' +-()' for ch in term):
+            return digits
+        return term
+
+    def rebuild(self, summaries):
+        """Recria o índice a partir de uma lista de resumos (dicts com contact e name)"""
+        self.keys = {s['contact']: self._key(s['contact'], s.get('name')) for s in summaries}
+        self.last_term = self.last_matches = None
+
+    def update(self, contact, name=None):
+        """Inclui ou atualiza um contato a partir de um delta"""
+        key = self._key(contact, name)
+        if self.keys.get(contact) != key:
+            self.keys[contact] = key
+            self.last_term = self.last_matches = None
+
+    def search(self, term):
+        """Retorna o conjunto de contatos cujo número ou nome contém term"""
+        term = self._normalize(term)
+        if not term:
+            return set(self.keys)
+        if self.last_term is not None and term.startswith(self.last_term):
+            candidates = self.last_matches
+        else:
+            candidates = self.keys
+        matches = {contact for contact in candidates if term in self.keys[contact]}
+        self.last_term, self.last_matches = term, matches
+        return matches
+
+class ConversationListModel:
+    """
+    Camada de visualização da lista de conversas.
+    
+    Compara a nova ordem de contatos com a exibida no Listbox e aplica apenas as
+    remoções, inserções e mudanças de cor necessárias, mantendo um índice
+    contato -> linha para buscas O(1).
+    """
+    UNREAD_BG = '#D4E6F1'   # fundo das conversas com mensagens não lidas
+
+    def __init__(self, listbox):
+        self.listbox = listbox
+        self.rows = []       # contatos na ordem exibida
+        self.index = {}      # contato -> linha
+        self.colors = {}     # contato -> cor de fundo exibida
+
+    def _reindex(self):
+        self.index = {contact: row for row, contact in enumerate(self.rows)}
+
+    @staticmethod
+    def _longest_increasing(positions):
+        """Índices (em positions) de uma maior subsequência crescente"""
+        tails = []
+        tail_idx = []
+        prev = [-1] * len(positions)
+        for i, value in enumerate(positions):
+            lo, hi = 0, len(tails)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if tails[mid] < value:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            if lo == len(tails):
+                tails.append(value)
+                tail_idx.append(i)
+            else:
+                tails[lo] = value
+                tail_idx[lo] = i
+            prev[i] = tail_idx[lo - 1] if lo > 0 else -1
+        result = set()
+        i = tail_idx[-1] if tail_idx else -1
+        while i != -1:
+            result.add(i)
+            i = prev[i]
+        return result
+
+    def apply(self, entries):
+        """
+        Atualiza o Listbox para exibir entries, uma lista ordenada de (contato, cor).
+        
+        As linhas que já estão na ordem relativa correta são mantidas; as demais
+        são removidas e reinseridas na posição nova.
+        """
+        target = [contact for contact, _ in entries]
+        target_pos = {contact: pos for pos, contact in enumerate(target)}
+        selected = self.selected()
+        
+        # Linhas atuais que continuam visíveis, e as que ficam paradas (maior
+        # subsequência já em ordem)
+        kept_rows = [row for row, contact in enumerate(self.rows) if contact in target_pos]
+        positions = [target_pos[self.rows[row]] for row in kept_rows]
+        stay = {kept_rows[i] for i in self._longest_increasing(positions)}
+        
+        # Remover de baixo para cima para não deslocar os índices ainda pendentes
+        for row in range(len(self.rows) - 1, -1, -1):
+            if row not in stay:
+                self.colors.pop(self.rows[row], None)
+                self.listbox.delete(row)
+                del self.rows[row]
+        
+        # Inserir em ordem crescente: tudo que vem antes de pos já está no lugar
+        present = set(self.rows)
+        for pos, contact in enumerate(target):
+            if contact not in present:
+                self.listbox.insert(pos, contact)
+                self.rows.insert(pos, contact)
+        self._reindex()
+        
+        for contact, color in entries:
+            self.set_color(contact, color)
+        
+        if selected is not None and selected in self.index:
+            self.select(selected, see=False)
+
+    def set_color(self, contact, color):
+        row = self.index.get(contact)
+        if row is None or self.colors.get(contact) == color:
+            return
+        self.listbox.itemconfig(row, {'bg': color})
+        self.colors[contact] = color
+
+    def entries(self):
+        return [(contact, self.colors.get(contact, 'white')) for contact in self.rows]
+
+    def index_of(self, contact):
+        return self.index.get(contact)
+
+    def selected(self):
+        selection = self.listbox.curselection()
+        if selection and selection[0] < len(self.rows):
+            return self.rows[selection[0]]
+        return None
+
+    def select(self, contact, see=True):
+        row = self.index.get(contact)
+        if row is None:
+            return False
+        self.listbox.selection_clear(0, tk.END)
+        self.listbox.selection_set(row)
+        if see:
+            self.listbox.see(row)
+        return True
+
 class WhatsAppInterface:
     def __init__(self, root):
         self.root = root
@@ -145,6 +387,11 @@ class WhatsAppInterface:
         self.message_queue = queue.Queue()
         self.current_attachment = None
         
+        # Banco e API são acessados em segundo plano para não travar a interface
+        self.tasks = BackgroundTasks(self.root)
+        self.search_index = ContactSearchIndex()
+        self.filter_after_id = None
+        
         # Configurando estilo personalizado para a aplicação
         self.style = ttk.Style()
         self.style.configure("TFrame", background=COLORS["bg_gray"])
@@ -156,15 +403,21 @@ class WhatsAppInterface:
         
         # Configurar layout principal
         self.setup_main_layout()
-        self.load_initial_messages()
         
-        self.update_thread = threading.Thread(target=self.check_new_messages, daemon=True)
-        self.update_thread.start()
+        # Marca d'água da sincronização incremental: maior id já refletido na interface
+        self.last_message_id = None
+        self.chat_last_id = 0
+        self.chat_loading_older = False
+        self.tasks.submit(get_last_message_id, self.set_last_message_id, key='sync')
+        self.load_initial_messages()
         
         self.process_message_queue()
         
-        # Iniciar verificação periódica de arquivo flag
-        self.root.after(1000, self.check_new_messages_flag)
+        # Receber avisos de novas mensagens do webhook pelo canal /events (sem polling)
+        self.refresh_pending = False
+        self.resync_requested = False
+        self.notification_listener = NotificationListener(self.on_new_messages_notification)
+        self.notification_listener.start()
         
         # Status bar
         self.status_bar = ttk.Label(self.root, text="Pronto", relief=tk.SUNKEN, anchor=tk.W)
@@ -187,6 +440,7 @@ class WhatsAppInterface:
         menu_bar.add_cascade(label="Ferramentas", menu=tools_menu)
         tools_menu.add_command(label="Configurações", command=self.show_settings)
         tools_menu.add_command(label="Exportar Conversas", command=self.export_conversations)
+        tools_menu.add_command(label="Recarregar Credenciais", command=self.reload_credentials)
         
         # Menu Ajuda
         help_menu = tk.Menu(menu_bar, tearoff=0)
@@ -194,6 +448,14 @@ class WhatsAppInterface:
         help_menu.add_command(label="Manual do Usuário", command=lambda: webbrowser.open("https://docs.example.com/whatsapp-api"))
         help_menu.add_command(label="Sobre", command=self.show_about)
 
+    def reload_credentials(self):
+        """Recarregar token e IDs do .env sem reiniciar a aplicação"""
+        try:
+            reload_sender()
+            self.status_bar.config(text="Credenciais recarregadas do .env")
+        except Exception as e:
+            messagebox.showerror("Erro", f"Erro ao recarregar credenciais: {str(e)}")
+
     def setup_main_layout(self):
         # Container principal
         main_container = ttk.Frame(self.root, style="TFrame")
@@ -248,7 +510,13 @@ class WhatsAppInterface:
         
         self.search_entry = ttk.Entry(search_frame, textvariable=self.search_var)
         self.search_entry.pack(fill=tk.X, padx=(5, 5), expand=True)
-        self.search_var.trace('w', self.filter_conversations)
+        self.search_var.trace('w', self.schedule_filter)
+        
+        # Modo de busca no texto das mensagens (índice FTS5) em vez do número/nome
+        self.search_content_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.left_frame, text="Buscar no texto das mensagens",
+                        variable=self.search_content_var,
+                        command=self.filter_conversations).pack(anchor=tk.W, padx=10)
 
         # Lista de conversas com estilo personalizado
         self.conversation_frame = ttk.Frame(self.left_frame)
@@ -274,6 +542,8 @@ class WhatsAppInterface:
         self.conversation_list.pack(fill=tk.BOTH, expand=True)
         self.conv_scrollbar.config(command=self.conversation_list.yview)
         self.conversation_list.bind('<<ListboxSelect>>', self.on_select_conversation)
+        self.conversation_model = ConversationListModel(self.conversation_list)
+        self.conversation_summaries = {}  # contato -> resumo da tabela conversations
         
         # Botão de novo chat
         new_chat_button = ttk.Button(
@@ -320,7 +590,7 @@ class WhatsAppInterface:
             bd=1,
             relief=tk.SOLID,
             highlightthickness=0,
-            yscrollcommand=messages_scrollbar.set,
+            yscrollcommand=lambda first, last: self.on_messages_scroll(messages_scrollbar, first, last),
             state=tk.DISABLED
         )
         self.messages_area.pack(fill=tk.BOTH, expand=True)
@@ -502,76 +772,71 @@ class WhatsAppInterface:
         
         if not message and not self.current_attachment:
             return
-            
-        try:
-            self.status_bar.config(text="Enviando mensagem...")
-            
-            sender = WhatsAppSender()
-            selection = self.conversation_list.curselection()
-            
-            if not selection:
-                return
-                
-            recipient = self.conversation_list.get(selection[0])
-            
-            if not recipient:
-                return
-            
-            # Se tiver anexo, enviar primeiro
-            if self.current_attachment:
-                # Implementação do envio de anexo seria aqui
-                pass
-                
-            result = sender.send_text_message(
+        
+        recipient = self.conversation_model.selected()
+        if not recipient:
+            return
+        
+        # Se tiver anexo, enviar primeiro
+        if self.current_attachment:
+            # Implementação do envio de anexo seria aqui
+            pass
+        
+        self.status_bar.config(text="Enviando mensagem...")
+        self.send_button.config(state=tk.DISABLED)
+        
+        def send():
+            # Executado em segundo plano: chamada à API e gravação no banco
+            result = get_sender().send_text_message(
                 to=recipient,
                 message=message
             )
             
             if not result or 'messages' not in result:
+                return None
+            
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE messages
+                    SET answered = 1
+                    WHERE sender = ? AND recipient = ? AND answered = 0
+                ''', (recipient, recipient))
+                cursor.execute('''
+                    INSERT INTO messages (whatsapp_id, sender, recipient, message, message_type, status, answered)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (result['messages'][0]['id'], 'Você', recipient, message, 'text', 'sent', 1))
+            return result
+        
+        def on_sent(result):
+            self.send_button.config(state=tk.NORMAL)
+            if result is None:
                 self.status_bar.config(text="Erro ao enviar mensagem")
                 return
-                
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE messages
-                SET answered = 1
-                WHERE sender = ? AND recipient = ? AND answered = 0
-            ''', (recipient, recipient))
-            cursor.execute('''
-                INSERT INTO messages (whatsapp_id, sender, recipient, message, message_type, status, answered)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (result['messages'][0]['id'], 'Você', recipient, message, 'text', 'sent', 1))
-            
-            conn.commit()
-            conn.close()
-            
-            self.add_message("Você", message)
-            self.message_entry.delete(0, tk.END)
+            
+            if recipient == self.current_conversation:
+                self.add_message("Você", message)
+            # Não apagar o que o usuário começou a digitar enquanto o envio acontecia
+            if self.message_entry.get().strip() == message:
+                self.message_entry.delete(0, tk.END)
             
             # Limpar anexo após envio
             self.clear_attachment()
             
-            self.load_initial_messages()
-            if recipient:
-                # Procura o número na lista de conversas
-                items = self.conversation_list.get(0, tk.END)
-                if recipient in items:
-                    index = items.index(recipient)
-                    # Reseleciona a conversa atual
-                    self.conversation_list.selection_clear(0, tk.END)
-                    self.conversation_list.selection_set(index)
-                    self.conversation_list.see(index)
-                    # Mantém o cursor no campo de mensagem
+            def reselect():
+                # Reseleciona a conversa atual e mantém o cursor no campo de mensagem
+                if self.conversation_model.select(recipient):
                     self.message_entry.focus()
             
+            self.load_initial_messages(on_done=reselect)
             self.status_bar.config(text="Mensagem enviada com sucesso")
-            
-        except Exception as e:
+        
+        def on_error(e):
+            self.send_button.config(state=tk.NORMAL)
             self.status_bar.config(text=f"Erro ao enviar mensagem: {str(e)}")
             print(f"Erro ao enviar mensagem: {e}")
-            import traceback
-            print(f"Traceback completo: {traceback.format_exc()}")
+        
+        self.tasks.submit(send, on_sent, on_error)
 
     def add_message(self, sender, message):
         if sender == self.current_conversation or sender == "Você":
@@ -605,275 +870,351 @@ class WhatsAppInterface:
             self.contact_photo.config(text="👤")
             self.status_bar.config(text=f"Conversa com {self.current_conversation} selecionada")
             
-            # Marcar todas as mensagens deste contato como visualizadas
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE messages
-                SET visualized = 1
-                WHERE sender = ? AND sender != 'Você' AND visualized = 0
-            ''', (self.current_conversation,))
-            
-            conn.commit()
-            conn.close()
-            
             # Remover destaque de fundo da conversa selecionada
-            self.conversation_list.itemconfig(selection, {'bg': 'white'})
+            self.conversation_model.set_color(self.current_conversation, 'white')
+            if self.current_conversation in self.conversation_summaries:
+                self.conversation_summaries[self.current_conversation]['unread_count'] = 0
             
-            # Carregar as mensagens com animação de carregamento
+            # Mostrar indicador enquanto as mensagens são carregadas em segundo plano
             self.messages_area.config(state=tk.NORMAL)
             self.messages_area.delete(1.0, tk.END)
             self.messages_area.insert(tk.END, "Carregando mensagens...", "timestamp_received")
             self.messages_area.config(state=tk.DISABLED)
             
-            # Usar after para criar sensação de carregamento
-            self.root.after(300, self.load_conversation_messages)
+            # Marcar todas as mensagens deste contato como visualizadas e carregar o histórico
+            self.load_conversation_messages(mark_read=True)
             
             # Focar no campo de entrada
             self.message_entry.focus()
 
-    def load_conversation_messages(self):
+    def load_conversation_messages(self, mark_read=False):
+        """Carrega em segundo plano só a página mais recente; as anteriores vêm ao rolar para o topo."""
+        contact = self.current_conversation
+        
+        def query():
+            if mark_read:
+                with db_connection() as conn:
+                    conn.execute('''
+                        UPDATE messages
+                        SET visualized = 1
+                        WHERE sender = ? AND sender != 'Você' AND visualized = 0
+                    ''', (contact,))
+            return fetch_conversation_page(contact, limit=CHAT_PAGE_SIZE)
+        
+        def failed(e):
+            if contact != self.current_conversation:
+                return
+            # Liberar a paginação para uma nova tentativa (ex.: banco travado ou drive fora do ar)
+            self.chat_loading_older = False
+            print(f"Erro ao carregar mensagens de {contact}: {e}")
+            self.status_bar.config(text=f"Erro ao carregar mensagens: {e}")
+            if self.messages_area.get('1.0', 'end-1c') == "Carregando mensagens...":
+                self.messages_area.config(state=tk.NORMAL)
+                self.messages_area.delete(1.0, tk.END)
+                self.messages_area.insert(tk.END, "Não foi possível carregar as mensagens. "
+                                          "Selecione a conversa novamente para tentar de novo.",
+                                          "timestamp_received")
+                self.messages_area.config(state=tk.DISABLED)
+        
+        # Bloquear a paginação até a página inicial chegar
+        self.chat_loading_older = True
+        # A chave "chat" descarta cargas pendentes de uma conversa que já foi trocada
+        self.tasks.submit(query, lambda messages: self.show_conversation_messages(contact, messages), failed,
+                          key='chat')
+
+    def show_conversation_messages(self, contact, messages):
+        """Exibe a página mais recente do histórico (thread principal)."""
+        if contact != self.current_conversation:
+            return
+        
         self.messages_area.config(state=tk.NORMAL)
         self.messages_area.delete(1.0, tk.END)
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Consulta modificada para buscar as mensagens corretamente
-        cursor.execute('''
-            SELECT sender, recipient, message, timestamp, status FROM messages
-            WHERE (sender = ? AND recipient = '556199571754') OR (sender = 'Você' AND recipient = ?)
-            ORDER BY timestamp ASC
-        ''', (self.current_conversation, self.current_conversation))
         
-        messages = cursor.fetchall()
-        conn.close()
+        self.chat_oldest = (messages[0]['timestamp'], messages[0]['id']) if messages else None
+        self.chat_has_more = len(messages) == CHAT_PAGE_SIZE
+        self.chat_loading_older = False
         
-        # Adicionar efeito de "histórico" se houver muitas mensagens
-        if len(messages) > 10:
+        # Adicionar efeito de "histórico" quando todo o histórico já está na tela
+        if not self.chat_has_more and len(messages) > 10:
             self.messages_area.insert(tk.END, "--- Início da conversa ---\n\n", "timestamp_received")
         
+        self.chat_last_id = 0
         for msg in messages:
-            sender, recipient, message, timestamp, status = msg
-            try:
-                dt = datetime.fromisoformat(timestamp)
-                time_str = dt.strftime("%H:%M")
-            except:
-                time_str = "12:00" # Fallback
-            
-            # Adicionar espaço para margem
-            self.messages_area.insert(tk.END, "\n")
-            
-            # Modificação: verificar com base no status (received/sent)
-            if sender == "Você" or status == "sent":
-                self.messages_area.insert(tk.END, f"{message}\n", ("sent", "sent_bubble"))
-                self.messages_area.insert(tk.END, f"{time_str} ✓\n", "timestamp_sent")
-            else:
-                self.messages_area.insert(tk.END, f"{message}\n", ("received", "received_bubble"))
-                self.messages_area.insert(tk.END, f"{time_str}\n", "timestamp_received")
+            self.render_message(msg['sender'], msg['message'], msg['timestamp'], msg['status'])
+            self.chat_last_id = max(self.chat_last_id, msg['id'])
         
         self.messages_area.config(state=tk.DISABLED)
         self.messages_area.see(tk.END)
         
         # Atualizar status
-        self.status_bar.config(text=f"Conversa com {self.current_conversation} carregada")
-
-    def load_initial_messages(self):
-        conn = get_db_connection()
-        conn.row_factory = sqlite3.Row  # Usar dicionários para resultados
-        cursor = conn.cursor()
-        
-        # Consulta otimizada para identificar conversas com mensagens não lidas
-        cursor.execute('''
-            SELECT
-                CASE
-                    WHEN sender = 'Você' THEN recipient
-                    ELSE sender
-                END AS contact,
-                SUM(CASE WHEN sender != 'Você' AND (visualized = 0 OR visualized IS NULL) THEN 1 ELSE 0 END) AS unread_count,
-                MAX(timestamp) as last_timestamp,
-                MAX(CASE WHEN sender != 'Você' THEN message ELSE "" END) as last_message
-            FROM messages
-            GROUP BY contact
-            HAVING contact != 'Você'
-            ORDER BY unread_count DESC, last_timestamp DESC
-        ''')
-        
-        contacts = cursor.fetchall()
-        conn.close()
-        
-        self.conversation_list.delete(0, tk.END)
-        
-        for contact in contacts:
-            contact_name = contact['contact']
-            unread_count = contact['unread_count']
+        self.status_bar.config(text=f"Conversa com {contact} carregada")
+
+    def on_messages_scroll(self, scrollbar, first, last):
+        """Repassa a posição para a scrollbar e pede a página anterior ao chegar no topo."""
+        scrollbar.set(first, last)
+        if (float(first) <= 0.0 and float(last) < 1.0 and self.current_conversation
+                and getattr(self, 'chat_has_more', False) and not self.chat_loading_older):
+            self.chat_loading_older = True
+            self.root.after_idle(self.load_older_messages)
+
+    def load_older_messages(self):
+        """Busca em segundo plano a página anterior à mensagem mais antiga exibida."""
+        contact = self.current_conversation
+        before = self.chat_oldest
+        
+        def show(messages):
+            self.chat_loading_older = False
+            if contact != self.current_conversation or before != self.chat_oldest:
+                return
+            self.chat_has_more = len(messages) == CHAT_PAGE_SIZE
+            if not messages:
+                return
+            self.chat_oldest = (messages[0]['timestamp'], messages[0]['id'])
             
-            # CORREÇÃO: Tratamento seguro para acesso à coluna
-            try:
-                last_message = contact['last_message']
-                if last_message:
-                    last_message = last_message[:20]  # Limitar o tamanho
-                else:
-                    last_message = ''
-            except (IndexError, KeyError):
-                last_message = ''
-            
-            if contact_name != 'Você':
-                # Adicionar indicador de mensagens não lidas
-                display_text = contact_name
-                if unread_count > 0:
-                    display_text = f"{contact_name} ({unread_count})"
-                
-                self.conversation_list.insert(tk.END, contact_name)  # Guardar apenas o número
-                
-                # Índice do item adicionado
-                index = self.conversation_list.size() - 1
-                
-                if unread_count > 0:
-                    # Colorir conversas com mensagens não lidas
-                    self.conversation_list.itemconfig(index, {'bg': '#D4E6F1'})  # Use a cor definida ou COLORS["unread_bg"]
+            lines_before = int(self.messages_area.index('end-1c').split('.')[0])
+            self.messages_area.config(state=tk.NORMAL)
+            # Inserir na marca: cada mensagem entra depois da anterior, antes do conteúdo atual
+            self.messages_area.mark_set('history', '1.0')
+            if not self.chat_has_more:
+                self.messages_area.insert('history', "--- Início da conversa ---\n\n", "timestamp_received")
+            for msg in messages:
+                self.render_message(msg['sender'], msg['message'], msg['timestamp'], msg['status'], index='history')
+            self.messages_area.mark_unset('history')
+            self.messages_area.config(state=tk.DISABLED)
+            
+            # Manter na tela a mensagem que estava no topo antes do carregamento
+            lines_added = int(self.messages_area.index('end-1c').split('.')[0]) - lines_before
+            self.messages_area.yview(f"{lines_added + 1}.0")
+        
+        def failed(e):
+            self.chat_loading_older = False
+            print(f"Erro ao carregar mensagens anteriores: {e}")
+        
+        self.tasks.submit(lambda: fetch_conversation_page(contact, before=before, limit=CHAT_PAGE_SIZE),
+                          show, failed, key='chat')
 
+    def render_message(self, sender, message, timestamp, status, index=tk.END):
+        """Insere um balão de mensagem em index (padrão: final) na área de mensagens, que deve estar em NORMAL"""
+        try:
+            dt = datetime.fromisoformat(timestamp)
+            time_str = dt.strftime("%H:%M")
+        except:
+            time_str = "12:00" # Fallback
+        
+        # Adicionar espaço para margem
+        self.messages_area.insert(index, "\n")
+        
+        # Modificação: verificar com base no status (received/sent)
+        if sender == "Você" or status == "sent":
+            self.messages_area.insert(index, f"{message}\n", ("sent", "sent_bubble"))
+            self.messages_area.insert(index, f"{time_str} ✓\n", "timestamp_sent")
+        else:
+            self.messages_area.insert(index, f"{message}\n", ("received", "received_bubble"))
+            self.messages_area.insert(index, f"{time_str}\n", "timestamp_received")
+
+    def load_initial_messages(self, on_done=None):
+        """Recarrega a lista de conversas em segundo plano; on_done roda após a lista ser atualizada."""
+        def show(contacts):
+            # Resumo por contato mantido por triggers (ver database.migration_003)
+            self.conversation_summaries = {contact['contact']: dict(contact) for contact in contacts
+                                           if contact['contact'] != 'Você'}
+            self.search_index.rebuild(self.conversation_summaries.values())
+            if self.search_var.get():
+                self.filter_conversations()
+            else:
+                self.show_conversations([contact['contact'] for contact in contacts if contact['contact'] != 'Você'])
+            if on_done:
+                on_done()
+        
+        self.tasks.submit(fetch_all_conversations, show, key='conversations')
+
+    def show_conversations(self, contacts):
+        """Exibe os contatos na ordem dada, aplicando só as diferenças no Listbox."""
+        entries = []
+        for contact in contacts:
+            summary = self.conversation_summaries.get(contact)
+            unread_count = summary['unread_count'] if summary else 0
+            # Colorir conversas com mensagens não lidas
+            entries.append((contact, ConversationListModel.UNREAD_BG if unread_count > 0 else 'white'))
+        self.conversation_model.apply(entries)
+
+    def sorted_conversations(self):
+        """Contatos ordenados como na lista: não lidas primeiro, depois pela última mensagem"""
+        summaries = sorted(
+            self.conversation_summaries.values(),
+            key=lambda s: (s['unread_count'] or 0, s['last_timestamp'] or ''),
+            reverse=True
+        )
+        return [summary['contact'] for summary in summaries]
 
     def update_interface_with_new_messages(self):
         """Atualiza a interface quando novas mensagens são detectadas."""
         self.status_bar.config(text="Atualizando conversas...")
         
         # Salvar a seleção atual
-        selected_indices = self.conversation_list.curselection()
-        selected_item = None
-        if selected_indices:
-            selected_item = self.conversation_list.get(selected_indices[0])
-        
-        # Recarregar a lista de conversas com efeito de carregamento
-        self.root.after(100, lambda: self.load_initial_messages())
+        selected_item = self.conversation_model.selected()
         
         # Restaurar a seleção
         def restore_selection():
-            if selected_item:
-                items = self.conversation_list.get(0, tk.END)
-                if selected_item in items:
-                    index = items.index(selected_item)
-                    self.conversation_list.selection_clear(0, tk.END)
-                    self.conversation_list.selection_set(index)
-                    
-                    # Se estiver na conversa ativa, recarregar mensagens
-                    if selected_item == self.current_conversation:
-                        self.load_conversation_messages()
+            if selected_item and self.conversation_model.select(selected_item, see=False):
+                # Se estiver na conversa ativa, recarregar mensagens
+                if selected_item == self.current_conversation:
+                    self.load_conversation_messages()
             
             self.status_bar.config(text="Pronto")
-                        
-        self.root.after(300, restore_selection)
+        
+        self.load_initial_messages(on_done=restore_selection)
 
-    def check_new_messages_flag(self):
-        """Verifica se há um arquivo de flag indicando novas mensagens."""
-        try:
-            flag_file = "new_messages_flag.txt"
-            if os.path.exists(flag_file):
-                modified_time = os.path.getmtime(flag_file)
-                current_time = time.time()
+    def on_new_messages_notification(self, message_ids):
+        """Chamado pela thread do NotificationListener quando o webhook grava mensagens.
+        
+        message_ids é None quando a conexão foi (re)estabelecida e a interface
+        precisa de uma ressincronização completa.
+        """
+        if message_ids is not None and not message_ids:
+            return
+        if message_ids is None:
+            self.resync_requested = True
+        # Agrupar rajadas de avisos em uma única atualização na thread principal
+        if self.refresh_pending:
+            return
+        self.refresh_pending = True
+        
+        def refresh():
+            self.refresh_pending = False
+            if self.resync_requested:
+                self.resync_requested = False
                 
-                # Se o arquivo foi modificado nos últimos 10 segundos
-                if current_time - modified_time < 10:
-                    # Atualizar interface
-                    print("Flag de novas mensagens detectada!")
-                    self.status_bar.config(text="Novas mensagens recebidas!")
+                def resync(last_id):
+                    self.set_last_message_id(last_id)
                     self.update_interface_with_new_messages()
-        except Exception as e:
-            print(f"Erro ao verificar flag: {e}")
+                
+                self.tasks.submit(get_last_message_id, resync, key='sync')
+            else:
+                self.sync_new_messages()
+        
+        self.root.after(0, refresh)
+
+    def set_last_message_id(self, last_id):
+        self.last_message_id = last_id
+
+    def sync_new_messages(self):
+        """Busca em segundo plano só as mensagens acima da marca d'água e aplica os deltas."""
+        if self.last_message_id is None:
+            return  # A carga inicial ainda não terminou e já inclui essas mensagens
+        since = self.last_message_id
+        current = self.current_conversation
+        
+        def query():
+            new_rows = []
+            cursor = since
+            while True:
+                rows = fetch_messages_since(cursor)
+                if not rows:
+                    break
+                new_rows.extend(rows)
+                cursor = rows[-1]['id']
+            
+            contacts = set()
+            for row in new_rows:
+                contact = row['recipient'] if row['sender'] == 'Você' else row['sender']
+                if contact and contact != 'Você':
+                    contacts.add(contact)
+            
+            # A conversa aberta recebe as mensagens na tela: já contam como vistas
+            if current in contacts:
+                with db_connection() as conn:
+                    conn.execute('''
+                        UPDATE messages
+                        SET visualized = 1
+                        WHERE sender = ? AND visualized = 0
+                    ''', (current,))
+            return new_rows, cursor, fetch_conversations(contacts)
         
-        # Verificar a cada 1 segundo
-        self.root.after(1000, self.check_new_messages_flag)
+        def apply(result):
+            new_rows, cursor, summaries = result
+            if not new_rows:
+                return
+            self.last_message_id = max(self.last_message_id or 0, cursor)
+            print(f"Encontradas {len(new_rows)} novas mensagens!")
+            
+            chat_updated = False
+            self.messages_area.config(state=tk.NORMAL)
+            for row in new_rows:
+                # Mensagens enviadas pela própria interface já foram desenhadas em add_message
+                if (row['sender'] == self.current_conversation and row['sender'] == current
+                        and row['id'] > self.chat_last_id):
+                    self.render_message(row['sender'], row['message'], row['timestamp'], row['status'])
+                    self.chat_last_id = row['id']
+                    chat_updated = True
+            self.messages_area.config(state=tk.DISABLED)
+            if chat_updated:
+                self.messages_area.see(tk.END)
+            
+            self.update_conversation_rows(summaries)
+            self.status_bar.config(text="Novas mensagens recebidas!")
+        
+        self.tasks.submit(query, apply, key='sync')
 
-    def check_new_messages(self):
-        """Thread para verificar novas mensagens periodicamente."""
-        last_check_time = datetime.now()
+    def update_conversation_rows(self, summaries):
+        """Atualiza o resumo das conversas que mudaram e reposiciona só essas linhas."""
+        for summary in summaries:
+            self.conversation_summaries[summary['contact']] = dict(summary)
+            self.search_index.update(summary['contact'], summary['name'])
         
-        while True:
-            try:
-                current_time = datetime.now()
-                
-                # Verificar se há novas mensagens desde a última verificação
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    SELECT id, whatsapp_id, sender, recipient, message, message_type,
-                        status, timestamp, answered, visualized
-                    FROM messages
-                    WHERE sender != 'Você' AND timestamp > ?
-                    ORDER BY timestamp ASC
-                ''', (last_check_time.isoformat(),))
-                
-                new_messages = cursor.fetchall()
-                conn.close()
-                
-                if new_messages:
-                    print(f"Encontradas {len(new_messages)} novas mensagens!")
-                    last_check_time = current_time
-                    
-                    # Importante: atualizar a interface na thread principal
-                    self.root.after(0, self.update_interface_with_new_messages)
-                
-                # Verificar a cada 2 segundos
-                time.sleep(2)
-                
-            except Exception as e:
-                print(f"Erro ao verificar novas mensagens: {e}")
-                import traceback
-                traceback.print_exc()
-                time.sleep(5)
+        if self.search_var.get():
+            self.filter_conversations()
+        else:
+            self.show_conversations(self.sorted_conversations())
 
     def process_message_queue(self):
         """Processa mensagens da fila e atualiza a interface."""
         try:
-            messages_processed = False
+            messages = []
             while not self.message_queue.empty():
-                msg = self.message_queue.get_nowait()
-                messages_processed = True
-                
-                print(f"Processando nova mensagem de: {msg['sender']}")
-                self.status_bar.config(text=f"Nova mensagem de {msg['sender']}")
-                
-                # Inserir mensagem no banco de dados
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                
-                # Adicionado campo visualized=0 para marcar mensagens como não lidas
-                cursor.execute('''
-                    INSERT INTO messages (whatsapp_id, sender, recipient, message, message_type, status, timestamp, visualized)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (msg['id'], msg['sender'], 'Você', msg['message'], msg['type'], 'received', msg['timestamp'], 0))
+                messages.append(self.message_queue.get_nowait())
+            
+            # Somente atualizar a interface se processou mensagens
+            if messages:
+                current = self.current_conversation
                 
-                conn.commit()
-                conn.close()
+                def save():
+                    # Inserir mensagens no banco de dados (em segundo plano)
+                    with db_connection() as conn:
+                        # Adicionado campo visualized=0 para marcar mensagens como não lidas
+                        conn.executemany('''
+                            INSERT INTO messages (whatsapp_id, sender, recipient, message, message_type, status, timestamp, visualized)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                        ''', [(msg['id'], msg['sender'], 'Você', msg['message'], msg['type'], 'received', msg['timestamp'], 0)
+                              for msg in messages])
+                        
+                        # Marcar como visualizada se estiver na conversa ativa
+                        if any(msg['sender'] == current for msg in messages):
+                            conn.execute('''
+                                UPDATE messages
+                                SET visualized = 1
+                                WHERE sender = ? AND visualized = 0
+                            ''', (current,))
                 
-                # Atualizar interface se a conversa atual for com o remetente
-                if self.current_conversation == msg['sender']:
-                    self.add_message(msg['sender'], msg['message'])
+                def show(_):
+                    for msg in messages:
+                        print(f"Processando nova mensagem de: {msg['sender']}")
+                        self.status_bar.config(text=f"Nova mensagem de {msg['sender']}")
+                        # Atualizar interface se a conversa atual for com o remetente
+                        if self.current_conversation == msg['sender']:
+                            self.add_message(msg['sender'], msg['message'])
                     
-                    # Marcar como visualizada se estiver na conversa ativa
-                    conn = get_db_connection()
-                    cursor = conn.cursor()
-                    cursor.execute('''
-                        UPDATE messages
-                        SET visualized = 1
-                        WHERE sender = ? AND visualized = 0
-                    ''', (msg['sender'],))
-                    conn.commit()
-                    conn.close()
-        
-            # Somente atualizar a interface se processou mensagens
-            if messages_processed:
-                print("Mensagens processadas, atualizando interface...")
-                self.load_initial_messages()
+                    print("Mensagens processadas, atualizando interface...")
+                    
+                    # Se a conversa atual estiver aberta, manter selecionada
+                    def keep_selection():
+                        if self.current_conversation:
+                            self.conversation_model.select(self.current_conversation, see=False)
+                    
+                    self.load_initial_messages(on_done=keep_selection)
                 
-                # Se a conversa atual estiver aberta, manter selecionada
-                if self.current_conversation:
-                    items = self.conversation_list.get(0, tk.END)
-                    if self.current_conversation in items:
-                        index = items.index(self.current_conversation)
-                        self.conversation_list.selection_clear(0, tk.END)
-                        self.conversation_list.selection_set(index)
+                self.tasks.submit(save, show,
+                                  lambda e: print(f"Erro ao processar fila de mensagens: {e}"))
 
         except Exception as e:
             print(f"Erro ao processar fila de mensagens: {e}")
@@ -883,36 +1224,47 @@ class WhatsAppInterface:
         # Agendar próxima verificação
         self.root.after(500, self.process_message_queue)
 
+    def schedule_filter(self, *args):
+        """Agrupa as teclas digitadas na busca: filtra só após uma breve pausa"""
+        if self.filter_after_id is not None:
+            self.root.after_cancel(self.filter_after_id)
+        self.filter_after_id = self.root.after(SEARCH_DEBOUNCE_MS, self.filter_conversations)
+
     def filter_conversations(self, *args):
-        search_term = self.search_var.get().lower()
-        self.conversation_list.delete(0, tk.END)
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT DISTINCT
-                CASE
-                    WHEN sender = 'Você' THEN recipient
-                    ELSE sender
-                END AS contact,
-                MAX(CASE WHEN (sender != 'Você' AND visualized = 0) THEN 1 ELSE 0 END) AS has_unread
-            FROM messages
-            GROUP BY contact
-            ORDER BY has_unread DESC, MAX(timestamp) DESC
-        ''')
-        
-        contacts = cursor.fetchall()
-        conn.close()
-        
-        for contact, has_unread in contacts:
-            if contact != 'Você' and (not search_term or search_term in contact.lower()):
-                self.conversation_list.insert(tk.END, contact)
-                if has_unread == 1:
-                    index = self.conversation_list.size() - 1
-                    self.conversation_list.itemconfig(index, {'bg': COLORS["unread_bg"]})
-        
-        self.status_bar.config(text=f"Filtrando conversas: {search_term}")
+        """Filtra a lista pelo índice em memória (número ou nome), sem consultar o banco"""
+        self.filter_after_id = None
+        search_term = self.search_var.get()
+        
+        if self.search_content_var.get() and search_term.strip():
+            self.search_message_content(search_term)
+            return
+        # Uma busca por conteúdo ainda em andamento não deve sobrescrever este filtro
+        self.tasks.cancel('search')
+        
+        matches = self.search_index.search(search_term)
+        self.show_conversations([contact for contact in self.sorted_conversations() if contact in matches])
+        
+        if search_term:
+            self.status_bar.config(text=f"Filtrando conversas: {search_term}")
+
+    def search_message_content(self, search_term):
+        """Busca o termo no texto das mensagens e lista as conversas encontradas, por relevância"""
+        def show(results):
+            contacts = []
+            seen = set()
+            for row in results:
+                contact = row['recipient'] if row['sender'] == 'Você' else row['sender']
+                if contact and contact != 'Você' and contact not in seen:
+                    seen.add(contact)
+                    contacts.append(contact)
+            self.show_conversations(contacts)
+            
+            self.status_bar.config(
+                text=f"{len(results)} mensagens com \"{search_term}\" em {len(contacts)} conversas"
+            )
+        
+        self.status_bar.config(text=f"Buscando mensagens: {search_term}")
+        self.tasks.submit(lambda: search_messages(search_term), show, key='search')
 
     # Novos métodos para funcionalidades adicionais
     
@@ -933,16 +1285,11 @@ class WhatsAppInterface:
             dialog.destroy()
             
             # Adicionar à lista se não existir
-            numbers = self.conversation_list.get(0, tk.END)
-            if number not in numbers:
-                self.conversation_list.insert(0, number)
-                self.conversation_list.itemconfig(0, {'bg': 'white'})
+            if self.conversation_model.index_of(number) is None:
+                self.conversation_model.apply([(number, 'white')] + self.conversation_model.entries())
             
             # Selecionar a conversa
-            self.conversation_list.selection_clear(0, tk.END)
-            index = self.conversation_list.get(0, tk.END).index(number)
-            self.conversation_list.selection_set(index)
-            self.conversation_list.see(index)
+            self.conversation_model.select(number)
             
             # Gatilho manual para carregar a conversa
             self.on_select_conversation(None)
@@ -1001,32 +1348,18 @@ class WhatsAppInterface:
         """Atualizar lista de conversas manualmente"""
         self.status_bar.config(text="Atualizando conversas...")
         
-        # Efeito visual de carregamento
-        current_selection = None
-        if self.conversation_list.curselection():
-            current_selection = self.conversation_list.get(self.conversation_list.curselection()[0])
-        
-        # Limpar lista atual
-        self.conversation_list.delete(0, tk.END)
-        self.conversation_list.insert(tk.END, "Carregando...")
+        current_selection = self.conversation_model.selected()
         
-        # Recarregar após breve delay para efeito visual
-        def reload_conversations():
-            self.conversation_list.delete(0, tk.END)
-            self.load_initial_messages()
-            
+        # Recarregar após breve delay para efeito visual; só as linhas que
+        # mudaram são alteradas no Listbox
+        def restore_selection():
             # Restaurar seleção se aplicável
             if current_selection:
-                items = self.conversation_list.get(0, tk.END)
-                if current_selection in items:
-                    index = items.index(current_selection)
-                    self.conversation_list.selection_clear(0, tk.END)
-                    self.conversation_list.selection_set(index)
-                    self.conversation_list.see(index)
+                self.conversation_model.select(current_selection)
             
             self.status_bar.config(text="Conversas atualizadas")
             
-        self.root.after(500, reload_conversations)
+        self.root.after(500, lambda: self.load_initial_messages(on_done=restore_selection))
 
     def show_settings(self):
         """Exibir janela de configurações"""
@@ -1230,11 +1563,9 @@ class WhatsAppInterface:
         test_number = "SEU_NUMERO_AQUI"  # Coloque o número que você usou para enviar a mensagem de teste
         
         # Encontrar o número na lista
-        items = self.conversation_list.get(0, tk.END)
-        if test_number in items:
-            index = items.index(test_number)
+        if self.conversation_model.index_of(test_number) is not None:
             # Destacar manualmente
-            self.conversation_list.itemconfig(index, {'bg': COLORS["unread_bg"]})
+            self.conversation_model.set_color(test_number, COLORS["unread_bg"])
             print(f"Número {test_number} destacado manualmente!")
         else:
             print(f"Número {test_number} não encontrado na lista!")
@@ -1382,37 +1713,47 @@ class TemplateSelector(tk.Toplevel):
                 self.template_listbox.insert(tk.END, template.get('name', 'Template sem nome'))
     
     def load_templates_from_api(self):
-        """Carrega templates diretamente da API da Meta"""
-        try:
-            # Inicializar o sender
-            sender = WhatsAppSender()
-            
-            # Obter templates da API
-            self.templates = sender.get_available_templates()
-            
-            # Parar animação de carregamento
-            self.loading_bar.stop()
-            self.loading_bar.pack_forget()
+        """Carrega templates diretamente da API da Meta, sem bloquear a janela"""
+        def fetch():
+            try:
+                # Obter o sender compartilhado e os templates da API
+                templates, error = get_sender().get_available_templates(), None
+            except Exception as e:
+                templates, error = [], e
+            try:
+                self.after(0, lambda: self.show_templates(templates, error))
+            except (RuntimeError, tk.TclError):
+                pass  # Janela fechada antes da resposta
+        
+        threading.Thread(target=fetch, daemon=True).start()
+    
+    def show_templates(self, templates, error=None):
+        """Preenche a lista com os templates recebidos (thread principal)"""
+        if not self.winfo_exists():
+            return
+        
+        # Parar animação de carregamento
+        self.loading_bar.stop()
+        self.loading_bar.pack_forget()
+        self.templates = templates or []
+        
+        if error is not None:
+            self.status_label.config(text=f"Erro ao carregar templates: {str(error)}")
+            messagebox.showerror("Erro", f"Erro ao carregar templates da API: {str(error)}")
+            return
+        
+        if not self.templates:
+            self.status_label.config(text="Nenhum template encontrado na API.")
+            return
             
-            if not self.templates:
-                self.status_label.config(text="Nenhum template encontrado na API.")
-                return
-                
-            # Limpar a listbox
-            self.template_listbox.delete(0, tk.END)
+        # Limpar a listbox
+        self.template_listbox.delete(0, tk.END)
+        
+        # Preencher a listbox com templates da API
+        for template in self.templates:
+            self.template_listbox.insert(tk.END, template.get('name', 'Template sem nome'))
             
-            # Preencher a listbox com templates da API
-            for template in self.templates:
-                self.template_listbox.insert(tk.END, template.get('name', 'Template sem nome'))
-                
-            self.status_label.config(text=f"{len(self.templates)} templates carregados.")
-                
-        except Exception as e:
-            self.loading_bar.stop()
-            self.loading_bar.pack_forget()
-            self.status_label.config(text=f"Erro ao carregar templates: {str(e)}")
-            messagebox.showerror("Erro", f"Erro ao carregar templates da API: {str(e)}")
-            self.templates = []
+        self.status_label.config(text=f"{len(self.templates)} templates carregados.")
             
     def show_template_details(self, event):
         selection = self.template_listbox.curselection()
@@ -1473,6 +1814,7 @@ class BulkSendWindow(tk.Toplevel):
         super().__init__(parent)
         self.parent = parent
         self.title("Envio em Massa")
+        self.tasks = BackgroundTasks(self, max_workers=1)
         
         # Tentativa de maximizar em diferentes sistemas
         try:
@@ -1497,6 +1839,7 @@ class BulkSendWindow(tk.Toplevel):
         # Variáveis
         self.csv_file_path = tk.StringVar()
         self.selected_template = None
+        self.csv_total_rows = None   # preenchido pela contagem em segundo plano
         
         # Componentes da interface
         self.create_widgets()
@@ -1788,31 +2131,12 @@ class BulkSendWindow(tk.Toplevel):
             # Atualizar status
             self.status_label.config(text="Carregando arquivo CSV...")
             
-            # Tentar carregar com diferentes configurações
-            df = None
-            excecoes = []
-            
-            # Tentativa 1: Separador ponto e vírgula, codificação UTF-8
-            try:
-                df = pd.read_csv(file_path, sep=';', encoding='utf-8')
-            except Exception as e:
-                excecoes.append(f"Tentativa 1: {str(e)}")
-                
-                # Tentativa 2: Separador vírgula, codificação UTF-8
-                try:
-                    df = pd.read_csv(file_path, sep=',', encoding='utf-8')
-                except Exception as e:
-                    excecoes.append(f"Tentativa 2: {str(e)}")
-                    
-                    # Tentativa 3: Codificação Latin-1
-                    try:
-                        df = pd.read_csv(file_path, encoding='latin1')
-                    except Exception as e:
-                        excecoes.append(f"Tentativa 3: {str(e)}")
-                        raise Exception("Não foi possível ler o arquivo CSV com nenhuma configuração")
+            # Ler só as primeiras linhas para a visualização
+            reader = CampaignReader(file_path)
+            df = reader.head(10)
             
             # Verificar se o DataFrame tem dados
-            if df is None or df.empty:
+            if df.empty:
                 self.preview_tree["columns"] = ["mensagem"]
                 self.preview_tree["show"] = "headings"
                 self.preview_tree.heading("mensagem", text="Aviso")
@@ -1834,23 +2158,13 @@ class BulkSendWindow(tk.Toplevel):
                 width = max(150, len(column) * 10)  # Aumentei a largura mínima
                 self.preview_tree.column(column, width=width, minwidth=100)
             
-            # Adicionar os dados (limitados a 10 linhas para preview)
-            for i, row in df.head(10).iterrows():
-                # Converter cada valor individualmente para string
-                values = []
-                for val in row:
-                    # Tratamento para valores especiais
-                    if pd.isna(val):
-                        values.append("")
-                    else:
-                        values.append(str(val))
-                
-                # Inserir no Treeview
-                self.preview_tree.insert("", "end", values=values)
+            # Adicionar os dados (limitados a 10 linhas para preview); células
+            # vazias já chegam como ""
+            for values in df.itertuples(index=False, name=None):
+                self.preview_tree.insert("", "end", values=list(values))
             
-            # Atualizar contadores
-            total_rows = len(df)
-            self.counter_label.config(text=f"{total_rows} contatos carregados | {total_rows} mensagens na fila")
+            # Contar as linhas em segundo plano; o contador é atualizado ao terminar
+            self.count_csv_rows(reader)
             
             # Atualizar status
             self.status_label.config(text="Arquivo CSV carregado com sucesso")
@@ -1868,6 +2182,36 @@ class BulkSendWindow(tk.Toplevel):
 
 
     
+    def count_csv_rows(self, reader):
+        """Conta as linhas do CSV em uma thread e atualiza o contador quando terminar"""
+        file_path = reader.path
+        self.csv_total_rows = None
+        self.counter_label.config(text="Contando contatos... | aguarde")
+        
+        def count():
+            try:
+                total_rows = reader.count_rows()
+            except Exception as e:
+                print(f"Erro ao contar linhas do CSV: {str(e)}")
+                total_rows = None
+            
+            def show():
+                # Outro arquivo pode ter sido escolhido enquanto a contagem rodava
+                if self.csv_file_path.get() != file_path:
+                    return
+                self.csv_total_rows = total_rows
+                if total_rows is None:
+                    self.counter_label.config(text="Não foi possível contar os contatos")
+                else:
+                    self.counter_label.config(text=f"{total_rows} contatos carregados | {total_rows} mensagens na fila")
+            
+            try:
+                self.after(0, show)
+            except (RuntimeError, tk.TclError):
+                pass  # Janela fechada antes do fim da contagem
+        
+        threading.Thread(target=count, daemon=True).start()
+    
     def select_template(self):
         template_selector = TemplateSelector(self)
         self.wait_window(template_selector)
@@ -1958,7 +2302,7 @@ class BulkSendWindow(tk.Toplevel):
             return
         
         # Confirmar o envio
-        total_rows = self.counter_label.cget("text").split("|")[0].strip().split()[0]
+        total_rows = self.csv_total_rows if self.csv_total_rows is not None else "todos os"
         confirm = messagebox.askyesno(
             "Confirmar Envio", 
             f"Você está prestes a enviar mensagens para {total_rows} contatos.\n\n"
@@ -2037,14 +2381,45 @@ class BulkSendWindow(tk.Toplevel):
                     self.progress_bar["value"] = progress
                     self.status_label.config(text=status_text)
                     self.counter_label.config(text=f"{total} contatos carregados | {total-current} mensagens restantes")
-                    
-                # Iniciar thread de envio
-                thread = threading.Thread(
-                    target=self.send_messages_thread,
-                    args=(csv_path, template_name, params_config, interval, limit, update_progress)
-                )
-                thread.daemon = True
-                thread.start()
+                
+                def start_send(resume):
+                    # Iniciar thread de envio
+                    thread = threading.Thread(
+                        target=self.send_messages_thread,
+                        args=(csv_path, template_name, params_config, interval, limit, update_progress, resume)
+                    )
+                    thread.daemon = True
+                    thread.start()
+                
+                def ask_resume(resumable):
+                    # Campanha interrompida com o mesmo arquivo e template: retomar de onde parou?
+                    if not resumable:
+                        start_send(True)
+                        return
+                    resume = messagebox.askyesnocancel(
+                        "Retomar Campanha",
+                        f"Um envio anterior deste arquivo com o template {template_name} foi interrompido "
+                        f"depois de {resumable[1]} mensagens enviadas.\n\n"
+                        "Sim: continuar de onde parou, sem reenviar para quem já recebeu\n"
+                        "Não: recomeçar do início (todos recebem de novo)\n"
+                        "Cancelar: não enviar agora"
+                    )
+                    # Janela fechada ou cancelada: não recomeçar a campanha por engano
+                    if resume is None:
+                        self.send_button.config(state="normal")
+                        self.status_label.config(text="Envio cancelado")
+                        return
+                    start_send(resume)
+                
+                def lookup_failed(e):
+                    self.send_button.config(state="normal")
+                    self.status_label.config(text=f"Erro: {str(e)}")
+                    messagebox.showerror("Erro", f"Erro ao consultar envios anteriores deste arquivo: {str(e)}")
+                
+                # A consulta ao registro de campanhas (banco no drive de rede) roda fora da thread do Tk
+                self.status_label.config(text="Verificando envios anteriores deste arquivo...")
+                self.tasks.submit(lambda: CampaignLedger.find_resumable(csv_path, template_name),
+                                  ask_resume, lookup_failed, key='resume')
                 
             else:
                 # Se estiver usando mensagem personalizada
@@ -2085,14 +2460,15 @@ class BulkSendWindow(tk.Toplevel):
             messagebox.showerror("Erro", f"Erro ao enviar mensagens: {str(e)}")
             self.status_label.config(text=f"Erro: {str(e)}")
     
-    def send_messages_thread(self, csv_path, template_name, params_config, interval, limit, callback):
+    def send_messages_thread(self, csv_path, template_name, params_config, interval, limit, callback, resume=True):
         """Thread para envio de mensagens com template da API"""
         try:
-            # Usar a função existente
+            # Usar a função existente; o progresso de cada destinatário fica no registro da campanha
             result = process_csv_with_dynamic_template(
                 csv_file=csv_path,
                 template_name=template_name, 
-                params_config=params_config
+                params_config=params_config,
+                resume=resume
             )
             
             # Atualizar UI quando concluir
@@ -2121,14 +2497,16 @@ class BulkSendWindow(tk.Toplevel):
     def send_custom_messages_thread(self, csv_path, template_text, params_config, interval, limit, callback):
         """Thread para envio de mensagens personalizadas"""
         try:
-            # Carregar CSV
-            df = pd.read_csv(csv_path)
-            total = len(df)
+            # Ler o CSV em blocos: o envio começa sem carregar o arquivo inteiro
+            reader = CampaignReader(csv_path)
+            total = reader.count_rows()
             
-            sender = WhatsAppSender()
+            sender = get_sender()
             sent_count = 0
+            seen = set()   # números já enviados nesta campanha
+            suppressed = load_suppressed_phones()   # quem respondeu "Não"
             
-            for index, row in df.iterrows():
+            for index, row in reader.records():
                 if sent_count >= limit:
                     break
                 
@@ -2139,15 +2517,22 @@ class BulkSendWindow(tk.Toplevel):
                     default = params_config[field]['default_value']
                     
                     if column in row:
-                        value = str(row[column])
-                        message = message.replace(f"{{{field}}}", value)
+                        message = message.replace(f"{{{field}}}", row[column])
                     else:
                         message = message.replace(f"{{{field}}}", default)
                 
                 # Obter número de telefone
                 phone_column = 'telefone'
                 if phone_column in row:
-                    phone = str(row[phone_column])
+                    phone = normalize_phone(row[phone_column])
+                    
+                    # Números inválidos, repetidos ou excluídos não gastam chamada à API nem intervalo
+                    if phone is None:
+                        print(f"Número inválido na linha {index+1}: {row[phone_column]}")
+                        continue
+                    if phone in seen or phone in suppressed:
+                        continue
+                    seen.add(phone)
                     
                     # Enviar mensagem
                     try:
@@ -2186,72 +2571,6 @@ class BulkSendWindow(tk.Toplevel):
             
             self.after(0, show_error)
 
-            
-            # Resultado final - apenas uma versão desta função
-            def complete():
-                self.status_label.config(text=f"Envio concluído. {sent_count} mensagens enviadas.")
-                self.send_button.config(state="normal")
-                self.progress_bar["value"] = 100
-                messagebox.showinfo("Sucesso", f"Envio de mensagens concluído!\n\n{sent_count} de {total} mensagens enviadas com sucesso.")
-            
-            self.after(0, complete)
-            
-        except Exception as e:
-            error_message = str(e)
-            print(f"Erro ao enviar mensagens: {error_message}")
-            
-            # Atualizar UI em caso de erro - apenas uma versão desta função
-            def show_error():
-                self.status_label.config(text=f"Erro: {error_message}")
-                self.send_button.config(state="normal")
-                messagebox.showerror("Erro", f"Erro ao enviar mensagens: {error_message}")
-            
-            self.after(0, show_error)
-
-          
-            # Resultado final
-            def complete():
-                self.status_label.config(text=f"Envio concluído. {sent_count} mensagens enviadas.")
-                self.send_button.config(state="normal")
-                self.progress_bar["value"] = 100
-                messagebox.showinfo("Sucesso", f"Envio de mensagens concluído!\n\n{sent_count} de {total} mensagens enviadas com sucesso.")
-            
-            self.after(0, complete)
-            
-        except Exception as e:
-            # Capturar a mensagem de erro aqui, antes de definir a função interna
-            error_message = str(e)
-            print(f"Erro ao enviar mensagens: {error_message}")
-            
-            # Atualizar UI em caso de erro
-            def show_error():
-                self.status_label.config(text=f"Erro: {error_message}")  # Usar a variável local
-                self.send_button.config(state="normal")
-                messagebox.showerror("Erro", f"Erro ao enviar mensagens: {error_message}")  # Usar a variável local
-            
-            self.after(0, show_error)
-
-
-
-            
-            # Resultado final
-            def complete():
-                self.status_label.config(text=f"Envio concluído. {sent_count} mensagens enviadas.")
-                self.send_button.config(state="normal")
-                self.progress_bar["value"] = 100
-                messagebox.showinfo("Sucesso", f"Envio de mensagens concluído!\n\n{sent_count} de {total} mensagens enviadas com sucesso.")
-            
-            self.after(0, complete)
-            
-        except Exception as e:
-            # Atualizar UI em caso de erro
-            def show_error():
-                self.status_label.config(text=f"Erro: {str(e)}")
-                self.send_button.config(state="normal")
-                messagebox.showerror("Erro", f"Erro ao enviar mensagens: {str(e)}")
-            
-            self.after(0, show_error)
-
 # Definindo constantes para cores
 COLORS = {
     "primary": "#128C7E",       # Verde WhatsApp
@@ -2265,6 +2584,9 @@ COLORS = {
 }
 
 def main():
+    # Aplicar migrações pendentes do banco antes de abrir a interface
+    create_tables()
+    
     root = tk.Tk()
     root.title("WhatsApp API Client")
     
@@ -0,0 +1,160 @@
+import hmac
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Endpoint SSE do webhook que a interface escuta para receber novas mensagens
+NOTIFICATIONS_URL = os.getenv('NOTIFICATIONS_URL', 'http://127.0.0.1:8080/events')
+# Sem NOTIFICATIONS_TOKEN no ambiente, o webhook gera o token neste arquivo e a
+# interface (na mesma máquina) o lê de lá
+NOTIFICATIONS_TOKEN_PATH = os.getenv('NOTIFICATIONS_TOKEN_PATH', 'notifications_token')
+HEARTBEAT_INTERVAL = 15     # segundos entre comentários keep-alive no stream
+SUBSCRIBER_QUEUE_SIZE = 1000
+RECONNECT_DELAY = 1         # segundos, dobra a cada falha consecutiva
+MAX_RECONNECT_DELAY = 30
+
+
+def get_notifications_token(create=False):
+    """
+    Token compartilhado exigido pelo endpoint /events.
+
+    Args:
+        create (bool, opcional): Gera e grava o arquivo de token se ainda não existir (lado do webhook)
+
+    Returns:
+        str: O token, ou None se não configurado
+    """
+    token = os.getenv('NOTIFICATIONS_TOKEN')
+    if token:
+        return token
+    try:
+        with open(NOTIFICATIONS_TOKEN_PATH, encoding='utf-8') as f:
+            token = f.read().strip()
+    except FileNotFoundError:
+        token = ''
+    if not token and create:
+        token = secrets.token_urlsafe(32)
+        try:
+            with open(NOTIFICATIONS_TOKEN_PATH, 'x', encoding='utf-8') as f:
+                f.write(token)
+        except FileExistsError:
+            # Outro processo gerou o arquivo ao mesmo tempo: usar o dele
+            return get_notifications_token()
+    return token or None
+
+
+def is_authorized(authorization):
+    """Confere o cabeçalho Authorization ("Bearer <token>") de quem pede o /events"""
+    token = get_notifications_token(create=True)
+    expected = f"Bearer {token}".encode('utf-8')
+    return hmac.compare_digest((authorization or '').encode('utf-8', 'replace'), expected)
+
+
+class NotificationHub:
+    """
+    Distribui avisos de novas mensagens para os clientes conectados (lado do webhook).
+
+    Cada assinante recebe sua própria fila; publish nunca bloqueia a gravação.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, message_ids):
+        """Envia a lista de ids recém-gravados para todos os assinantes"""
+        event = {'ids': list(message_ids)}
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                # Cliente lento: pede uma ressincronização completa em vez de acumular
+                logger.warning("Fila de notificações cheia, cliente será ressincronizado")
+                with subscriber.mutex:
+                    subscriber.queue.clear()
+                subscriber.put_nowait({'resync': True})
+
+    def stream(self):
+        """Gerador de eventos no formato text/event-stream para um novo assinante"""
+        subscriber = self.subscribe()
+        try:
+            # Avisar o cliente que a conexão está pronta (e que deve ressincronizar)
+            yield f"data: {json.dumps({'resync': True})}\n\n"
+            while True:
+                try:
+                    event = subscriber.get(timeout=HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+
+class NotificationListener:
+    """
+    Escuta o endpoint SSE em uma thread e chama callback a cada evento (lado da interface).
+
+    Args:
+        callback (callable): Recebe a lista de ids novos, ou None quando a interface
+            precisa ressincronizar (conexão (re)estabelecida ou eventos perdidos)
+        url (str, opcional): Endereço do endpoint de eventos
+    """
+    def __init__(self, callback, url=NOTIFICATIONS_URL):
+        self.callback = callback
+        self.url = url
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="notification-listener", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self):
+        delay = RECONNECT_DELAY
+        while not self.stopped.is_set():
+            try:
+                # Lido a cada conexão: o arquivo de token pode surgir depois que o webhook subir
+                token = get_notifications_token()
+                if not token:
+                    raise RuntimeError(f"token do canal de notificações não encontrado "
+                                       f"(NOTIFICATIONS_TOKEN ou {NOTIFICATIONS_TOKEN_PATH})")
+                with requests.get(self.url, stream=True, timeout=(5, HEARTBEAT_INTERVAL * 2),
+                                  headers={'Authorization': f"Bearer {token}"}) as response:
+                    response.raise_for_status()
+                    delay = RECONNECT_DELAY
+                    for line in response.iter_lines(decode_unicode=True):
+                        if self.stopped.is_set():
+                            return
+                        if not line or not line.startswith('data:'):
+                            continue
+                        event = json.loads(line[len('data:'):].strip())
+                        self.callback(None if event.get('resync') else event.get('ids', []))
+            except Exception as e:
+                logger.warning(f"Conexão com o canal de notificações perdida: {e}")
+            self.stopped.wait(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
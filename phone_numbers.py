@@ -0,0 +1,109 @@
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# Quantidade de números já normalizados mantidos em memória (caminho de um número por vez)
+PHONE_CACHE_SIZE = 100000
+
+# DDDs válidos no Brasil
+BRAZIL_AREA_CODES = frozenset([
+    '11', '12', '13', '14', '15', '16', '17', '18', '19',
+    '21', '22', '24', '27', '28',
+    '31', '32', '33', '34', '35', '37', '38',
+    '41', '42', '43', '44', '45', '46', '47', '48', '49',
+    '51', '53', '54', '55',
+    '61', '62', '63', '64', '65', '66', '67', '68', '69',
+    '71', '73', '74', '75', '77', '79',
+    '81', '82', '83', '84', '85', '86', '87', '88', '89',
+    '91', '92', '93', '94', '95', '96', '97', '98', '99',
+])
+
+_NON_DIGITS = re.compile(r'\D')
+# Formato comum, já sem pontuação: [55] DDD número; grupos: DDD e número.
+# Números com + ou 0 inicial não casam e seguem pelo caminho completo
+_PUNCTUATION = str.maketrans('', '', ' \t\r\n().-')
+_COMMON_FORMAT = re.compile(r'(?:55)?([1-9][1-9])(9\d{8}|[2-9]\d{7})')
+
+
+@lru_cache(maxsize=PHONE_CACHE_SIZE)
+def normalize_phone(phone):
+    """
+    Normaliza um telefone para o formato E.164 (+5561999999999).
+
+    Aceita números brasileiros com ou sem o 55, com zero de longa distância
+    e código de operadora (0 XX 61 ...), e inclui o 9º dígito que falta em
+    celulares antigos (61 9957-1754 -> +5561999571754). Números de outros
+    países só são aceitos quando escritos com + ou 00.
+
+    Args:
+        phone (str): Número em qualquer formato
+
+    Returns:
+        str: Número normalizado, ou None se o número for inválido
+    """
+    if phone is None:
+        return None
+    phone = str(phone).strip()
+    digits = _NON_DIGITS.sub('', phone)
+
+    international = phone.startswith('+') or digits.startswith('00')
+    if digits.startswith('00'):
+        digits = digits[2:]
+    elif digits.startswith('0'):
+        # Zero de longa distância, opcionalmente seguido do código da operadora
+        digits = digits.lstrip('0')
+        if len(digits) in (12, 13) and not digits.startswith('55'):
+            digits = digits[2:]
+
+    if international and not digits.startswith('55'):
+        return '+' + digits if 8 <= len(digits) <= 15 else None
+
+    if len(digits) in (12, 13) and digits.startswith('55'):
+        digits = digits[2:]
+    if len(digits) not in (10, 11):
+        return None
+
+    area_code, number = digits[:2], digits[2:]
+    if area_code not in BRAZIL_AREA_CODES:
+        return None
+    if len(number) == 9:
+        if number[0] != '9':
+            return None
+    elif number[0] in '6789':
+        number = '9' + number   # celular sem o 9º dígito
+    elif number[0] not in '2345':
+        return None
+    return '+55' + area_code + number
+
+
+def _normalize_common(phone):
+    """Caminho rápido para o formato comum; o resto vai para normalize_phone"""
+    match = _COMMON_FORMAT.fullmatch(phone.translate(_PUNCTUATION))
+    if match and match.group(1) in BRAZIL_AREA_CODES:
+        area_code, number = match.groups()
+        if len(number) == 8 and number[0] in '6789':
+            number = '9' + number   # celular sem o 9º dígito
+        return '+55' + area_code + number
+    return normalize_phone(phone)
+
+
+def normalize_phone_series(phones):
+    """
+    Normaliza uma coluna inteira de telefones de uma vez.
+
+    Cada valor distinto é normalizado uma única vez (pd.factorize) e os formatos
+    comuns são resolvidos por um único regex compilado; só o que sobra (+, 00,
+    zero de longa distância, números inválidos) passa por normalize_phone.
+
+    Args:
+        phones (pd.Series): Números em qualquer formato
+
+    Returns:
+        pd.Series: Números normalizados, com None nos inválidos (mesmo índice da entrada)
+    """
+    codes, uniques = pd.factorize(phones.fillna('').astype(str))
+    normalized = np.array([_normalize_common(phone) for phone in uniques.tolist()] + [None], dtype=object)
+    # factorize usa -1 para valores ausentes: cai no None acrescentado no fim
+    return pd.Series(normalized[codes], index=phones.index, dtype=object)
@@ -1,24 +1,201 @@
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List
 import os
 from dotenv import load_dotenv
 import json
+from campaign_reader import CampaignReader
+from phone_numbers import normalize_phone, normalize_phone_series
+from database import load_suppressed_phones
+from campaign_ledger import CampaignLedger
+
+# Valores padrão do motor de envio em massa (podem ser sobrescritos pelo .env)
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_MESSAGES_PER_SECOND = 20
+
+# Configuração do pool de conexões HTTP com a Graph API
+HTTP_POOL_SIZE = 16
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_READ_TIMEOUT = 30
+
+# Dados que a definição do template na Meta não traz (ex.: a imagem real do cabeçalho)
+KNOWN_TEMPLATES = {
+    'oferta_inss': {
+        'header_image': 'https://i.imgur.com/cl59zpz.png',
+        'parameter_names': ['nome'],
+    },
+}
+
+
+class CompiledTemplate:
+    """
+    Payload de um template pré-montado, reaproveitado em todos os envios.
+    
+    A parte fixa (produto, idioma, cabeçalho com imagem...) é serializada em
+    JSON uma única vez; a cada mensagem só o número e os parâmetros do corpo
+    são codificados e concatenados aos fragmentos prontos.
+    
+    Args:
+        name (str): Nome do template na Meta
+        language (str, opcional): Código de idioma
+        header_image (str, opcional): Link da imagem do componente de cabeçalho
+        parameter_names (list, opcional): Nomes dos parâmetros do corpo, para
+            templates com parâmetros nomeados; None para posicionais
+    """
+    _TO_SLOT = '@@to@@'
+    _BODY_SLOT = '@@body@@'
+
+    def __init__(self, name: str, language: str = 'pt_BR', header_image: str = None, parameter_names: List[str] = None):
+        self.name = name
+        self.parameter_names = parameter_names
+        components = []
+        if header_image:
+            components.append({
+                'type': 'header',
+                'parameters': [{'type': 'image', 'image': {'link': header_image}}]
+            })
+        components.append({'type': 'body', 'parameters': self._BODY_SLOT})
+        skeleton = json.dumps({
+            'messaging_product': 'whatsapp',
+            'to': self._TO_SLOT,
+            'type': 'template',
+            'template': {
+                'name': name,
+                'language': {'code': language},
+                'components': components
+            }
+        })
+        self.prefix, rest = skeleton.split(json.dumps(self._TO_SLOT))
+        self.middle, self.suffix = rest.split(json.dumps(self._BODY_SLOT))
+
+    @classmethod
+    def from_definition(cls, name: str, definition: dict = None) -> 'CompiledTemplate':
+        """
+        Compila um template a partir da definição retornada por get_available_templates.
+        
+        Sem definição, usa só o que está em KNOWN_TEMPLATES (ou um template posicional simples).
+        """
+        known = KNOWN_TEMPLATES.get(name.lower(), {})
+        definition = definition or {}
+        parameter_names = known.get('parameter_names')
+        if definition.get('parameter_format') == 'NAMED':
+            for component in definition.get('components', []):
+                if component.get('type') == 'BODY':
+                    named = component.get('example', {}).get('body_text_named_params', [])
+                    parameter_names = [param['param_name'] for param in named] or parameter_names
+        return cls(
+            name,
+            language=definition.get('language', 'pt_BR'),
+            header_image=known.get('header_image'),
+            parameter_names=parameter_names
+        )
+
+    def body_parameters(self, parameters):
+        """
+        Converte os parâmetros recebidos na lista do componente body.
+        
+        Um dict {nome: valor} é casado pelo nome do parâmetro; uma lista é
+        posicional e, em templates nomeados, segue a ordem da definição.
+        """
+        if isinstance(parameters, dict) and self.parameter_names is None:
+            # Definição sem nomes: usar os nomes recebidos
+            return [
+                {'type': 'text', 'text': str(value).strip(), 'parameter_name': name}
+                for name, value in parameters.items()
+            ]
+        if self.parameter_names is None:
+            # Para templates POSITIONAL como "primiero_contato_consignado"
+            return parameters
+        if isinstance(parameters, dict):
+            values = [parameters.get(name, '') for name in self.parameter_names]
+        else:
+            values = [param.get('text', '') for param in (parameters or []) if param.get('type') == 'text']
+            values += [''] * (len(self.parameter_names) - len(values))
+        return [
+            {'type': 'text', 'text': str(value).strip(), 'parameter_name': name}
+            for name, value in zip(self.parameter_names, values)
+        ]
+
+    def render(self, to: str, parameters) -> bytes:
+        """Monta o corpo JSON da requisição para um destinatário"""
+        return (self.prefix + json.dumps(to) + self.middle
+                + json.dumps(self.body_parameters(parameters)) + self.suffix).encode('utf-8')
 
 
 class WhatsAppSender:
-    def __init__(self):
-        load_dotenv()
+    def __init__(self, reload_env: bool = False):
+        load_dotenv(override=reload_env)
         self.token = os.getenv('WHATSAPP_TOKEN')
         self.phone_number_id = os.getenv('PHONE_NUMBER_ID')
         self.version = 'v17.0'
         self.base_url = f'https://graph.facebook.com/{self.version}/{self.phone_number_id}/messages'
+        self.timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+        self.session = self.create_session()
+        self.compiled_templates = {}
+        self.compiled_templates_lock = threading.Lock()
        
         print("Iniciando WhatsAppSender")
         print(f"Token encontrado: {self.token[:10]}..." if self.token else "Token não encontrado")
         print(f"Phone Number ID encontrado: {self.phone_number_id}" if self.phone_number_id else "Phone Number ID não encontrado")
 
+    def create_session(self) -> requests.Session:
+        """
+        Cria a sessão HTTP compartilhada por todos os envios.
+        
+        A sessão mantém conexões keep-alive com graph.facebook.com, evitando um
+        novo handshake TCP+TLS a cada mensagem.
+        
+        Returns:
+            requests.Session: Sessão com pool de conexões configurado
+        """
+        pool_size = max(HTTP_POOL_SIZE, int(os.getenv('WHATSAPP_MAX_WORKERS', DEFAULT_MAX_WORKERS)))
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, pool_block=True)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.headers.update({
+            'Authorization': f'Bearer {self.token}',
+            'Connection': 'keep-alive'
+        })
+        return session
+
+    def close(self):
+        """Fecha as conexões abertas do pool HTTP"""
+        self.session.close()
+
+    def get_compiled_template(self, template_name: str, template_info: dict = None) -> CompiledTemplate:
+        """
+        Retorna o payload pré-montado do template, compilando-o no primeiro uso.
+        
+        Args:
+            template_name (str): Nome do template
+            template_info (dict, opcional): Definição vinda de get_available_templates;
+                quando informada, substitui a compilação anterior
+        """
+        with self.compiled_templates_lock:
+            compiled = self.compiled_templates.get(template_name)
+            if compiled is None or template_info is not None:
+                compiled = CompiledTemplate.from_definition(template_name, template_info)
+                self.compiled_templates[template_name] = compiled
+            return compiled
+
+    def post_payload(self, body: bytes) -> Dict:
+        """Envia um corpo JSON já serializado para o endpoint de mensagens"""
+        try:
+            response = self.session.post(self.base_url, data=body, headers={'Content-Type': 'application/json'},
+                                         timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"Erro na requisição: {str(e)}")
+            if hasattr(e, 'response') and e.response is not None:
+                print(f"Detalhes do erro: {e.response.text}")
+                print(f"Payload enviado: {body.decode('utf-8')}")
+            raise
+
     def format_phone_number(self, phone: str) -> str:
         """
         Formata qualquer número de telefone para o padrão internacional +5511999999999.
@@ -28,80 +205,23 @@ class WhatsAppSender:
             
         Returns:
             str: Número formatado no padrão internacional
+            
+        Raises:
+            ValueError: Se o número for inválido (antes de gastar uma chamada à API)
         """
-        phone = phone.strip().replace(" ", "").replace("-", "").replace("(", "").replace(")", "")
-        if phone.startswith('+'): phone = phone[1:]
-        if not phone.startswith('55'): phone = '55' + phone
-        return '+' + phone
+        normalized = normalize_phone(phone)
+        if normalized is None:
+            raise ValueError(f"Número de telefone inválido: {phone}")
+        return normalized
 
     def send_template_message(self, to: str, template: str, parameters) -> Dict:
-        headers = {
-            'Authorization': f'Bearer {self.token}',
-            'Content-Type': 'application/json'
-        }
-       
         # Formatar o número de telefone usando o método dedicado
         to = self.format_phone_number(to)
        
-        # Payload base
-        payload = {
-            'messaging_product': 'whatsapp',
-            'to': to,
-            'type': 'template',
-            'template': {
-                'name': template,
-                'language': {
-                    'code': 'pt_BR'
-                },
-                'components': []
-            }
-        }
-       
-        # Lógica específica para cada template
-        if template.lower() == "oferta_inss":
-            # 1. Adicionar o componente de cabeçalho com estrutura completa para o tipo IMAGE
-            payload['template']['components'].append({
-                'type': 'header',
-                'parameters': [
-                    {
-                        'type': 'image',
-                        'image': {
-                            'link': 'https://i.imgur.com/cl59zpz.png'  # Link correto com extensão PNG
-                        }
-                    }
-                ]
-            })
-           
-            # 2. Adicionar o componente do corpo com o parâmetro NOMEADO "nome"
-            if isinstance(parameters, dict) and 'nome' in parameters:
-                payload['template']['components'].append({
-                    'type': 'body',
-                    'parameters': [
-                        {
-                            'type': 'text',
-                            'text': str(parameters['nome']).strip(),
-                            'parameter_name': 'nome'  # Adicionando o nome do parâmetro
-                        }
-                    ]
-                })
-        else:
-            # Para templates POSITIONAL como "primiero_contato_consignado"
-            # Manter o comportamento atual que já funciona
-            payload['template']['components'] = [{
-                'type': 'body',
-                'parameters': parameters
-            }]
-       
-        try:
-            response = requests.post(self.base_url, headers=headers, json=payload)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Erro na requisição: {str(e)}")
-            if hasattr(e, 'response') and e.response is not None:
-                print(f"Detalhes do erro: {e.response.text}")
-                print(f"Payload enviado: {json.dumps(payload, indent=2)}")
-            raise
+        # Payload pré-montado por template (ver CompiledTemplate): cabeçalho com imagem
+        # e formato dos parâmetros (nomeados para "oferta_inss", posicionais para os demais)
+        compiled = self.get_compiled_template(template)
+        return self.post_payload(compiled.render(to, parameters))
 
     def send_text_message(self, to: str, message: str) -> Dict:
         """
@@ -136,7 +256,7 @@ class WhatsAppSender:
        
         try:
             print(f"Enviando mensagem de texto para {to}")
-            response = requests.post(self.base_url, headers=headers, json=payload)
+            response = self.session.post(self.base_url, headers=headers, json=payload, timeout=self.timeout)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -152,75 +272,8 @@ class WhatsAppSender:
         """
         try:
             print(f"Enviando mensagem para {to} usando template {template_name}")
-            
-            payload = {
-                "messaging_product": "whatsapp",
-                "to": to,
-                "type": "template",
-                "template": {
-                    "name": template_name,
-                    "language": {
-                        "code": "pt_BR"
-                    },
-                    "components": []
-                }
-            }
-            
-            # Lógica específica para cada template
-            if template_name.lower() == "oferta_inss":
-                # 1. Adicionar o componente de cabeçalho com a imagem
-                payload['template']['components'].append({
-                    'type': 'header',
-                    'parameters': [
-                        {
-                            'type': 'image',
-                            'image': {
-                                'link': 'https://i.imgur.com/cl59zpz.png'
-                            }
-                        }
-                    ]
-                })
-                
-                # 2. Adicionar o componente do corpo com o parâmetro nomeado
-                nome_valor = ""
-                if isinstance(parameters, list) and parameters:
-                    for param in parameters:
-                        if param.get('type') == 'text':
-                            nome_valor = param.get('text', '')
-                            break
-                
-                payload['template']['components'].append({
-                    'type': 'body',
-                    'parameters': [
-                        {
-                            'type': 'text',
-                            'text': str(nome_valor),
-                            'parameter_name': 'nome'
-                        }
-                    ]
-                })
-            else:
-                # Para templates POSITIONAL como "primiero_contato_consignado"
-                payload['template']['components'] = [{
-                    'type': 'body',
-                    'parameters': parameters
-                }]
-            
-            # Enviar a requisição
-            url = f"https://graph.facebook.com/v17.0/{self.phone_number_id}/messages"
-            response = requests.post(
-                url,
-                json=payload,
-                headers={"Authorization": f"Bearer {self.token}"}
-            )
-            
-            # Verificar resposta
-            if response.status_code != 200:
-                print(f"Erro na requisição: {response.status_code} {response.reason} for url: {url}")
-                print(f"Detalhes do erro: {response.text}")
-                response.raise_for_status()
-            
-            return response.json()
+            compiled = self.get_compiled_template(template_name)
+            return self.post_payload(compiled.render(to, parameters))
         
         except Exception as e:
             print(f"Erro ao enviar mensagem de template para {to}: {str(e)}")
@@ -243,7 +296,7 @@ class WhatsAppSender:
         print(f"Token (primeiros 10 caracteres): {self.token[:10]}...")
        
         try:
-            response = requests.get(url, headers=headers)
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
             print(f"Status code: {response.status_code}")
             print(f"Resposta completa: {response.text}")
            
@@ -258,9 +311,299 @@ class WhatsAppSender:
             print(f"Traceback completo: {traceback.format_exc()}")
             return []
 
-def process_csv_with_dynamic_template(csv_file: str, template_name: str, params_config: dict, template_info=None):
+
+# Instância compartilhada do processo (uma leitura do .env e um pool HTTP)
+_shared_sender = None
+_shared_sender_lock = threading.Lock()
+
+
+def get_sender() -> WhatsAppSender:
     """
-    Processa um arquivo CSV e envia mensagens usando um template dinâmico
+    Retorna o WhatsAppSender compartilhado do processo, criando-o na primeira chamada.
+    
+    Returns:
+        WhatsAppSender: Instância única usada pela GUI, webhook e envios em massa
+    """
+    global _shared_sender
+    if _shared_sender is None:
+        with _shared_sender_lock:
+            if _shared_sender is None:
+                _shared_sender = WhatsAppSender()
+    return _shared_sender
+
+
+def reload_sender() -> WhatsAppSender:
+    """
+    Relê as credenciais do .env e substitui o WhatsAppSender compartilhado.
+    
+    Deve ser chamado explicitamente quando o token ou o Phone Number ID mudarem.
+    
+    Returns:
+        WhatsAppSender: Nova instância compartilhada
+    """
+    global _shared_sender
+    with _shared_sender_lock:
+        old_sender = _shared_sender
+        _shared_sender = WhatsAppSender(reload_env=True)
+    if old_sender is not None:
+        old_sender.close()
+    return _shared_sender
+
+
+class TokenBucket:
+    """
+    Limitador de taxa do tipo token-bucket, seguro para uso entre threads.
+
+    Args:
+        rate (float): Quantidade de tokens (mensagens) liberados por segundo
+        capacity (float, opcional): Tamanho máximo do balde (rajada permitida)
+    """
+    def __init__(self, rate: float, capacity: float = None):
+        if rate <= 0:
+            raise ValueError("A taxa do limitador deve ser maior que zero")
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Bloqueia até que um token esteja disponível e o consome"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class BulkSendEngine:
+    """
+    Motor de envio em massa: mantém várias requisições simultâneas em voo,
+    respeitando o limite de mensagens por segundo do nível da conta na Meta.
+
+    Args:
+        send_func (callable): Função que recebe um job e retorna a resposta da API
+        max_workers (int, opcional): Número de requisições simultâneas
+        rate_per_second (float, opcional): Limite de mensagens por segundo
+    """
+    def __init__(self, send_func, max_workers: int = None, rate_per_second: float = None):
+        self.send_func = send_func
+        self.max_workers = max_workers or int(os.getenv('WHATSAPP_MAX_WORKERS', DEFAULT_MAX_WORKERS))
+        rate = rate_per_second or float(os.getenv('WHATSAPP_MESSAGES_PER_SECOND', DEFAULT_MESSAGES_PER_SECOND))
+        self.bucket = TokenBucket(rate)
+
+    def _send(self, job):
+        self.bucket.acquire()
+        return self.send_func(job)
+
+    def run(self, jobs, total: int = None, progress_callback=None, ledger=None) -> Dict:
+        """
+        Envia todos os jobs e retorna as estatísticas do processamento.
+
+        Args:
+            jobs (iterable): Jobs no formato {'index': int, 'to': str, ...}; jobs com
+                'error' (número inválido) ou 'skip' (repetido ou excluído) são contabilizados sem envio
+            total (int, opcional): Total de jobs, usado no callback de progresso
+            progress_callback (callable, opcional): Função (atual, total, status)
+            ledger (CampaignLedger, opcional): Registro persistente onde o resultado de
+                cada job (status, id da mensagem, erro) é gravado em lotes
+
+        Returns:
+            dict: Estatísticas do processamento
+        """
+        results = {
+            'success': 0,
+            'error': 0,
+            'skipped': 0,
+            'error_log': []
+        }
+        lock = threading.Lock()
+        # Limita os jobs pendentes para não materializar a campanha inteira em memória
+        slots = threading.BoundedSemaphore(self.max_workers * 2)
+        done = [0]
+
+        def on_done(future, job):
+            message_id = None
+            try:
+                response = future.result()
+                ok = bool(response and 'messages' in response and len(response['messages']) > 0)
+                if ok:
+                    message_id = response['messages'][0].get('id')
+                status = f"Enviado para {job['to']}" if ok else f"Falha ao enviar para {job['to']}: Resposta inválida"
+            except Exception as e:
+                ok = False
+                status = f"Erro ao processar linha {job['index'] + 1}: {str(e)}"
+            finally:
+                slots.release()
+            record(job, 'success' if ok else 'error', status, message_id)
+
+        def record(job, outcome, status, message_id=None):
+            if ledger:
+                ledger.record(job['index'], job['to'], outcome, message_id,
+                              status if outcome == 'error' else None)
+            with lock:
+                done[0] += 1
+                results[outcome] += 1
+                if outcome == 'error':
+                    results['error_log'].append(status)
+                current = done[0]
+
+            if progress_callback:
+                progress_callback(current, total or current, status)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for job in jobs:
+                    # Rejeitados antes do envio: não consomem taxa nem requisição
+                    if 'error' in job:
+                        record(job, 'error', job['error'])
+                        continue
+                    if 'skip' in job:
+                        record(job, 'skipped', job['skip'])
+                        continue
+                    slots.acquire()
+                    future = executor.submit(self._send, job)
+                    future.add_done_callback(lambda f, job=job: on_done(f, job))
+        finally:
+            # Gravar o último lote mesmo se a campanha for interrompida por erro
+            if ledger:
+                ledger.flush()
+
+        return results
+
+def campaign_jobs(frame: pd.DataFrame, phone_column: str, parameter_lists: list, seen: set,
+                  suppressed: set = frozenset()):
+    """
+    Gera os jobs de um bloco do CSV com os telefones normalizados de uma vez.
+    
+    Números inválidos viram jobs com 'error'; números repetidos na campanha
+    (seen guarda os já enviados) ou na lista de exclusão (suppressed) viram
+    jobs com 'skip'. Nenhum deles chega à API.
+    """
+    phones = normalize_phone_series(frame[phone_column])
+    excluded = phones.isin(suppressed).tolist() if suppressed else [False] * len(phones)
+    raw_phones = frame[phone_column].tolist()
+    for index, raw, phone, is_excluded, parameters in zip(frame.index, raw_phones, phones.tolist(),
+                                                           excluded, parameter_lists):
+        if phone is None:
+            yield {'index': index, 'to': raw, 'error': f"Número inválido na linha {index + 1}: {raw}"}
+        elif is_excluded:
+            yield {'index': index, 'to': phone, 'skip': f"Número na lista de exclusão: {phone}"}
+        elif phone in seen:
+            yield {'index': index, 'to': phone, 'skip': f"Número repetido ignorado: {phone}"}
+        else:
+            seen.add(phone)
+            yield {'index': index, 'to': phone, 'parameters': parameters}
+
+def open_campaign_ledger(csv_path: str, template_name: str, resume: bool = True) -> CampaignLedger:
+    """Abre (ou retoma) o registro persistente da campanha e informa de onde o envio continua"""
+    ledger = CampaignLedger.open(csv_path, template_name, resume=resume)
+    if ledger.resumed:
+        print(f"Retomando campanha {ledger.campaign_id}: {len(ledger.done_rows)} linhas já concluídas, "
+              f"continuando a partir da linha {ledger.resume_from + 1}")
+    else:
+        print(f"Campanha {ledger.campaign_id} iniciada")
+    return ledger
+
+def campaign_frames(reader: CampaignReader, ledger: CampaignLedger):
+    """
+    Gera os blocos do CSV que ainda faltam enviar na campanha.
+    
+    As linhas antes da primeira pendente são descartadas pelo leitor; as
+    concluídas mais adiante (envios em paralelo terminam fora de ordem) são
+    filtradas pelo índice. O índice é a posição da linha interpretada pelo
+    pandas, o mesmo gravado no registro da campanha.
+    """
+    start_row = ledger.resume_from
+    done_after = sorted(row for row in ledger.done_rows if row >= start_row)
+    for frame in reader.frames(start_row):
+        if done_after and frame.index[0] <= done_after[-1]:
+            frame = frame[~frame.index.isin(done_after)]
+        yield frame
+
+def compile_parameter_slots(params_config: dict, columns: List[str], is_positional: bool) -> List[tuple]:
+    """
+    Resolve uma única vez, antes do envio, de onde vem cada parâmetro do template.
+    
+    Args:
+        params_config (dict): Configuração {parâmetro: {'csv_column': ..., 'default_value': ...}}
+        columns (list): Colunas (normalizadas) do CSV
+        is_positional (bool): Se o template usa parâmetros posicionais (1, 2, 3...)
+        
+    Returns:
+        list: Um (coluna ou None, valor padrão, nome) por parâmetro, na ordem de
+            envio; o nome é None em templates posicionais
+    """
+    if is_positional:
+        # Para parâmetros posicionais, a ordem é crítica (1, 2, 3...)
+        keys = []
+        for i in range(1, 10):  # Assumindo no máximo 9 parâmetros
+            if str(i) not in params_config:
+                break
+            keys.append(str(i))
+    else:
+        keys = list(params_config)
+    
+    slots = []
+    for key in keys:
+        config = params_config[key]
+        csv_column = config.get('csv_column', '').strip().lower()
+        # Coluna inexistente no CSV: usar sempre o valor padrão
+        slots.append((csv_column if csv_column and csv_column in columns else None,
+                      str(config.get('default_value', '')),
+                      None if is_positional else key))
+    return slots
+
+def build_text_parameters(frame: pd.DataFrame, slots: List[tuple]) -> List[list]:
+    """
+    Monta os parâmetros de texto de todas as linhas de um bloco do CSV.
+    
+    Os valores são extraídos coluna a coluna (células vazias ou NaN viram o
+    valor padrão do parâmetro) e só então agrupados por linha.
+    
+    Returns:
+        list: Para cada linha do bloco, a lista [{"type": "text", "text": ...}, ...]
+            (posicionais) ou o dict {nome: valor} (nomeados, casados pelo nome no envio)
+    """
+    if not slots:
+        return [[] for _ in range(len(frame))]
+    columns = []
+    for column, default, _ in slots:
+        if column is None:
+            columns.append([default] * len(frame))
+        else:
+            values = frame[column].fillna('').astype(str)
+            if default:
+                values = values.mask(values.str.strip() == '', default)
+            columns.append(values.tolist())
+    names = [name for _, _, name in slots]
+    if names[0] is not None:
+        return [dict(zip(names, row)) for row in zip(*columns)]
+    return [[{"type": "text", "text": value} for value in row] for row in zip(*columns)]
+
+def process_csv_with_dynamic_template(csv_file: str, template_name: str, params_config: dict, template_info=None,
+                                      progress_callback=None, max_workers=None, rate_per_second=None,
+                                      resume=True):
+    """
+    Processa um arquivo CSV e envia mensagens usando um template dinâmico.
+    
+    Os envios são feitos em paralelo pelo BulkSendEngine, limitados por
+    max_workers requisições simultâneas e rate_per_second mensagens por segundo.
+    O CSV é lido em blocos pelo CampaignReader: o envio começa com as primeiras
+    linhas, sem carregar o arquivo inteiro em memória.
+    
+    O resultado de cada destinatário fica gravado no registro da campanha
+    (CampaignLedger). Com resume=True, uma campanha interrompida com o mesmo
+    arquivo e template continua da primeira linha ainda não enviada; com
+    resume=False, ela é abandonada e o envio recomeça do início.
+    
+    Returns:
+        dict: Estatísticas do processamento
     """
     try:
         print("Iniciando processamento do CSV com template dinâmico")
@@ -271,30 +614,21 @@ def process_csv_with_dynamic_template(csv_file: str, template_name: str, params_
         if not params_config:
             print("AVISO: Configuração de parâmetros vazia. O template pode exigir parâmetros.")
         
-        # Carregar CSV usando ponto e vírgula explicitamente e mostrar as colunas
-        try:
-            df = pd.read_csv(csv_file, sep=';', encoding='utf-8')
-            print("CSV carregado com separador ';'")
-        except:
-            try:
-                df = pd.read_csv(csv_file, encoding='utf-8')
-                print("CSV carregado com separador padrão ','")
-            except:
-                df = pd.read_csv(csv_file, sep=';', encoding='latin1')
-                print("CSV carregado com encoding alternativo 'latin1'")
-            
-        print(f"CSV carregado com {len(df)} linhas")
-        print(f"Colunas disponíveis: {list(df.columns)}")
-        
-        # Normalizar nomes das colunas (remover espaços e converter para minúsculas)
-        df.columns = [col.strip().lower() for col in df.columns]
-        print(f"Colunas normalizadas: {list(df.columns)}")
+        # Abrir o CSV em modo de leitura em blocos, com nomes de colunas normalizados
+        # (sem espaços e em minúsculas)
+        reader = CampaignReader(csv_file, normalize_columns=True)
+        columns = reader.columns
+        print(f"CSV aberto com separador '{reader.sep}' e encoding '{reader.encoding}'")
+        print(f"Colunas normalizadas: {columns}")
         
         # Verificar coluna telefone
-        if 'telefone' not in df.columns:
-            raise ValueError(f"O arquivo CSV deve conter uma coluna 'telefone'. Colunas encontradas: {list(df.columns)}")
+        if 'telefone' not in columns:
+            raise ValueError(f"O arquivo CSV deve conter uma coluna 'telefone'. Colunas encontradas: {columns}")
         
-        sender = WhatsAppSender()
+        total_rows = reader.count_rows()
+        print(f"CSV com aproximadamente {total_rows} linhas")
+        
+        sender = get_sender()
         
         # Obter template_info se não fornecido
         if template_info is None:
@@ -302,80 +636,61 @@ def process_csv_with_dynamic_template(csv_file: str, template_name: str, params_
             template_info = next((t for t in templates if t['name'] == template_name), None)
         
         # Determinar tipo de formato de parâmetro
-        is_positional = template_info and template_info.get('parameter_format') == 'POSITIONAL'
+        if template_info is None:
+            # Sem definição (falha ao listar os templates ou nome não encontrado): deduzir
+            # pelas chaves da configuração, como antes ("1", "2"... são posicionais)
+            is_positional = bool(params_config) and all(str(key).isdigit() for key in params_config)
+            print(f"AVISO: definição do template {template_name} não encontrada; formato deduzido dos parâmetros")
+        else:
+            is_positional = template_info.get('parameter_format') == 'POSITIONAL'
         print(f"Template é posicional: {is_positional}")
         
-        # Processar cada linha
-        for idx, row in df.iterrows():
-            phone = str(row['telefone'])
-            # Usar o método de formatação de telefone
-            phone = sender.format_phone_number(phone)
-            
-            # Construir parâmetros
-            parameters = []
-            
-            # Se for posicional, precisamos garantir a ordem correta
-            if is_positional:
-                # Para parâmetros posicionais, a ordem é crítica (1, 2, 3...)
-                for i in range(1, 10):  # Assumindo no máximo 9 parâmetros
-                    param_key = str(i)
-                    if param_key not in params_config:
-                        break
-                    
-                    config = params_config[param_key]
-                    csv_column = config.get('csv_column', '').strip().lower()
-                    default_value = config.get('default_value', '')
-                    
-                    # Se a coluna CSV está especificada e existe no DataFrame
-                    if csv_column and csv_column in df.columns:
-                        value = str(row[csv_column])
-                    else:
-                        # Usar valor padrão
-                        value = default_value
-                    
-                    # Adicionar como um parâmetro separado!
-                    parameters.append({
-                        "type": "text",
-                        "text": str(value)
-                    })
-            else:
-                # Para parâmetros nomeados
-                for param_name, config in params_config.items():
-                    csv_column = config.get('csv_column', '').strip().lower()
-                    default_value = config.get('default_value', '')
-                    
-                    # Se a coluna CSV está especificada e existe no DataFrame
-                    if csv_column and csv_column in df.columns:
-                        value = str(row[csv_column])
-                    else:
-                        value = default_value
-                    
-                    parameters.append({
-                        "type": "text",
-                        "text": str(value)
-                    })
-            
-            # Debug para verificar parâmetros
-            print(f"Parâmetros para {phone}: {parameters}")
-            
-            # Enviar mensagem
-            print(f"Enviando mensagem para {phone} (linha {idx+1}/{len(df)})")
-            try:
-                sender.send_dynamic_template_message(
-                    to=phone,
-                    template_name=template_name,
-                    parameters=parameters
-                )
-                # Pequena pausa para evitar limites de taxa da API
-                time.sleep(1)
-            except Exception as e:
-                print(f"Erro ao enviar para {phone}: {str(e)}")
+        # Montar a parte fixa do payload uma vez para a campanha inteira
+        sender.get_compiled_template(template_name, template_info)
+        
+        # Mapeamento parâmetro -> coluna resolvido uma vez para a campanha inteira
+        slots = compile_parameter_slots(params_config, columns, is_positional)
+        
+        # Quem pediu para não receber mais mensagens (respondeu "Não")
+        suppressed = load_suppressed_phones()
+        print(f"{len(suppressed)} números na lista de exclusão")
+        
+        ledger = open_campaign_ledger(csv_file, template_name, resume)
+        
+        def build_jobs():
+            for frame in campaign_frames(reader, ledger):
+                # Telefones normalizados e validados por bloco; inválidos, repetidos e
+                # excluídos não são enviados
+                yield from campaign_jobs(frame, 'telefone', build_text_parameters(frame, slots),
+                                         ledger.sent_phones, suppressed)
+        
+        def send_job(job):
+            return sender.send_dynamic_template_message(
+                to=job['to'],
+                template_name=template_name,
+                parameters=job['parameters']
+            )
+        
+        # Enviar com várias requisições em voo, limitadas pela taxa da conta
+        engine = BulkSendEngine(send_job, max_workers=max_workers, rate_per_second=rate_per_second)
+        remaining = max(0, total_rows - len(ledger.done_rows))
+        print(f"Enviando {remaining} mensagens com {engine.max_workers} requisições simultâneas "
+              f"e limite de {engine.bucket.rate:g} mensagens/s")
+        results = engine.run(build_jobs(), total=remaining, progress_callback=progress_callback, ledger=ledger)
+        ledger.finish()
+        results['campaign_id'] = ledger.campaign_id
+        print(f"Envio concluído: {results['success']} enviadas, {results['error']} com erro, "
+              f"{results['skipped']} ignoradas (repetidas ou na lista de exclusão)")
+        for error in results['error_log']:
+            print(error)
+        return results
     
     except Exception as e:
         print(f"Erro ao processar arquivo CSV: {str(e)}")
         raise
  
-def process_csv_and_send_messages(csv_path, template_name, progress_callback=None, column_mapping=None):
+def process_csv_and_send_messages(csv_path, template_name, progress_callback=None, column_mapping=None,
+                                  max_workers=None, rate_per_second=None, resume=True):
     """
     Processa um arquivo CSV e envia mensagens usando um template.
    
@@ -383,6 +698,9 @@ def process_csv_and_send_messages(csv_path, template_name, progress_callback=Non
         csv_path (str): Caminho para o arquivo CSV
         template_name (str): Nome do template a ser usado
         progress_callback (callable, opcional): Função para reportar progresso
+        max_workers (int, opcional): Número de requisições simultâneas
+        rate_per_second (float, opcional): Limite de mensagens por segundo
+        resume (bool, opcional): Retomar a campanha interrompida com o mesmo arquivo e template
        
     Returns:
         dict: Estatísticas do processamento
@@ -390,19 +708,17 @@ def process_csv_and_send_messages(csv_path, template_name, progress_callback=Non
     results = {
         'success': 0,
         'error': 0,
+        'skipped': 0,
         'error_log': []
     }
    
     try:
-        # Tentar primeiro com ponto e vírgula (padrão brasileiro)
-        try:
-            df = pd.read_csv(csv_path, sep=';')
-        except:
-            # Se falhar, tentar com vírgula
-            df = pd.read_csv(csv_path)
+        # Leitura em blocos: o envio começa sem carregar o arquivo inteiro
+        reader = CampaignReader(csv_path)
+        columns = reader.columns
        
         # Identificar a coluna de telefone (deve ser 'telefone')
-        if 'telefone' not in df.columns:
+        if 'telefone' not in columns:
             raise ValueError("O CSV deve ter uma coluna chamada 'telefone'")
        
         phone_column = 'telefone'
@@ -414,72 +730,62 @@ def process_csv_and_send_messages(csv_path, template_name, progress_callback=Non
             # Verificar se as colunas necessárias existem
             required_columns = ['nome', 'empresa', 'valor']
             for col in required_columns:
-                if col not in df.columns:
+                if col not in columns:
                     raise ValueError(f"O CSV deve ter uma coluna '{col}' para o template {template_name}")
        
         elif "oferta_inss" in template_name_lower:
             # Verificar se a coluna 'nome' existe
-            if 'nome' not in df.columns:
+            if 'nome' not in columns:
                 raise ValueError(f"O CSV deve ter uma coluna 'nome' para o template {template_name}")
        
-        total_rows = len(df)
-        sender = WhatsAppSender()
+        total_rows = reader.count_rows()
+        sender = get_sender()
        
-        for index, row in df.iterrows():
-            try:
-                # Usar o método de formatação de telefone ao invés de fazer manualmente
-                phone = sender.format_phone_number(str(row[phone_column]))
-               
+        # Definir uma vez, antes do envio, quais colunas alimentam os parâmetros
+        if "primiero_contato_consignado" in template_name_lower:
+            # Template com 3 variáveis: nome, empresa, valor
+            slots = [('nome', '', None), ('empresa', '', None), ('valor', '', None)]
+        elif "oferta_inss" in template_name_lower:
+            slots = None
+        else:
+            # Template genérico - usar todas as colunas exceto telefone
+            slots = [(col, '', None) for col in columns if col != phone_column]
+       
+        # Quem pediu para não receber mais mensagens (respondeu "Não")
+        suppressed = load_suppressed_phones()
+        ledger = open_campaign_ledger(csv_path, template_name, resume)
+       
+        def build_jobs():
+            for frame in campaign_frames(reader, ledger):
                 # Preparar parâmetros de acordo com o template
-                parameters = []
-               
-                if "primiero_contato_consignado" in template_name_lower:
-                    # Template com 3 variáveis: nome, empresa, valor
-                    parameters = [
-                        {"type": "text", "text": str(row['nome'])},
-                        {"type": "text", "text": str(row['empresa'])},
-                        {"type": "text", "text": str(row['valor'])}
-                    ]
-               
-                elif "oferta_inss" in template_name_lower:
+                if slots is None:
                     # Template com 1 variável nomeada: nome
                     # Modificar o formato dos parâmetros para template NAMED
-                    parameters = {"nome": str(row['nome'])}
-               
-                else:
-                    # Template genérico - usar todas as colunas exceto telefone
-                    for col in df.columns:
-                        if col != phone_column:
-                            parameters.append({"type": "text", "text": str(row[col])})
-               
-                # Enviar a mensagem usando o formato original que funcionava
-                response = sender.send_template_message(
-                    to=phone,
-                    template=template_name,  # Use o nome do parâmetro que funcionava antes
-                    parameters=parameters
-                )
-               
-                # Verificar resultado
-                if response and 'messages' in response and len(response['messages']) > 0:
-                    results['success'] += 1
+                    parameter_lists = [{"nome": nome} for nome in frame['nome'].fillna('').astype(str).tolist()]
                 else:
-                    results['error'] += 1
-                    results['error_log'].append(f"Falha ao enviar para {phone}: Resposta inválida")
-               
-                # Reportar progresso
-                if progress_callback:
-                    status = f"Enviado para {phone}"
-                    progress_callback(index + 1, total_rows, status)
+                    parameter_lists = build_text_parameters(frame, slots)
                
-                # Pausa para evitar limitações de API
-                time.sleep(1)
-           
-            except Exception as e:
-                results['error'] += 1
-                results['error_log'].append(f"Erro ao processar linha {index+1}: {str(e)}")
-               
-                if progress_callback:
-                    progress_callback(index + 1, total_rows, f"Erro: {str(e)}")
+                # Telefones normalizados e validados por bloco; inválidos, repetidos e
+                # excluídos não são enviados
+                yield from campaign_jobs(frame, phone_column, parameter_lists, ledger.sent_phones, suppressed)
+       
+        def send_job(job):
+            # Enviar a mensagem usando o formato original que funcionava
+            return sender.send_template_message(
+                to=job['to'],
+                template=template_name,  # Use o nome do parâmetro que funcionava antes
+                parameters=job['parameters']
+            )
+       
+        engine = BulkSendEngine(send_job, max_workers=max_workers, rate_per_second=rate_per_second)
+        sent = engine.run(build_jobs(), total=max(0, total_rows - len(ledger.done_rows)),
+                          progress_callback=progress_callback, ledger=ledger)
+        ledger.finish()
+        results['campaign_id'] = ledger.campaign_id
+        results['success'] += sent['success']
+        results['error'] += sent['error']
+        results['skipped'] += sent['skipped']
+        results['error_log'].extend(sent['error_log'])
    
     except Exception as e:
         results['error'] += 1